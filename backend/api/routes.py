@@ -1,30 +1,73 @@
+import asyncio
 import json
+import os
 import time
 import uuid
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from typing import Iterator
+from contextlib import aclosing
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from typing import AsyncIterator, Optional
 
 from ..core.models import ChatRequest, ChatResponse, ConversationHistory, ChatMessage
+from ..core import metrics
+from ..core.config import settings
 from ..services.llm_service import LLMService
+from ..services.jupyter_gateway_service import JupyterGatewayService
+from ..services.scheduler import ConversationBusyError, QueueFullError
+from ..services.batch_service import BatchJob, BatchService
+from ..services.artifact_store import ArtifactStore
+from .sse import coalesce_content, encode_event
 
-router = APIRouter()
+def _busy(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-def create_routes(llm_service: LLMService) -> APIRouter:
+def _conversation_busy(e: ConversationBusyError) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def create_routes(llm_service: LLMService, jupyter_gateway_service: JupyterGatewayService,
+                  batch_service: BatchService, artifact_store: ArtifactStore) -> APIRouter:
+    router = APIRouter()
     
-    def stream_chat_response(request: ChatRequest) -> Iterator[str]:
-        """Generate SSE stream for chat response"""
-        conv_id = request.conversation_id or f"conv-{uuid.uuid4().hex[:12]}"
+    async def cancel_on_disconnect(http_request: Request, task: asyncio.Task):
+        """Cancel the streaming task once the client goes away; the request body has been read already.
         
-        for event in llm_service.chat_stream(conv_id, request.message):
-            event_data = event.model_dump(exclude_none=True)
-            yield f"data: {json.dumps(event_data)}\n\n"
+        The task rather than the conversation's turn: this request may still be
+        waiting behind another client's turn.
+        """
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+        task.cancel()
+    
+    async def stream_chat_response(request: ChatRequest, conv_id: str, http_request: Request) -> AsyncIterator[str]:
+        """Generate SSE stream for chat response"""
+        events = llm_service.chat_stream(conv_id, request.message)
+        if request.coalesce:
+            events = coalesce_content(events, settings.SSE_COALESCE_INTERVAL, settings.SSE_COALESCE_CHARS)
+        watcher = asyncio.create_task(cancel_on_disconnect(http_request, asyncio.current_task()))
+        try:
+            async with aclosing(events):
+                async for event in events:
+                    yield encode_event(event)
+        finally:
+            watcher.cancel()
     
     @router.post("/chat/stream")
-    async def chat_stream(request: ChatRequest):
+    async def chat_stream(request: ChatRequest, http_request: Request):
         """Streaming chat endpoint"""
+        conv_id = request.conversation_id or f"conv-{uuid.uuid4().hex[:12]}"
+        try:
+            llm_service.scheduler.check_admission()
+            llm_service.turns.check(conv_id)
+            if request.tools is not None:
+                llm_service.tool_registry.enable(conv_id, request.tools)
+        except QueueFullError as e:
+            raise _busy(e)
+        except ConversationBusyError as e:
+            raise _conversation_busy(e)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         return StreamingResponse(
-            stream_chat_response(request),
+            stream_chat_response(request, conv_id, http_request),
             media_type="text/plain",
             headers={
                 "Cache-Control": "no-cache",
@@ -33,31 +76,110 @@ def create_routes(llm_service: LLMService) -> APIRouter:
             }
         )
     
+    @router.post("/chat/{conv_id}/cancel")
+    async def cancel_chat(conv_id: str):
+        """Stop the conversation's streamed turn; its stream ends with a cancelled event"""
+        return {"conversation_id": conv_id, "cancelled": llm_service.cancel(conv_id)}
+    
     @router.post("/chat", response_model=ChatResponse)
     async def chat(request: ChatRequest):
-        """Synchronous chat endpoint"""
+        """Non-streaming chat endpoint"""
         conv_id = request.conversation_id or f"conv-{uuid.uuid4().hex[:12]}"
+        if request.tools is not None:
+            try:
+                llm_service.tool_registry.enable(conv_id, request.tools)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
         try:
-            response = llm_service.chat_sync(conv_id, request.message)
+            response = await llm_service.chat_sync(conv_id, request.message)
             return ChatResponse(
                 response=response,
                 conversation_id=conv_id,
                 timestamp=time.time()
             )
+        except QueueFullError as e:
+            raise _busy(e)
+        except ConversationBusyError as e:
+            raise _conversation_busy(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
+    async def stream_batch_results(job: BatchJob) -> AsyncIterator[str]:
+        async for result in batch_service.results(job):
+            yield json.dumps(result) + "\n"
+    
+    def batch_response(job: BatchJob) -> StreamingResponse:
+        return StreamingResponse(
+            stream_batch_results(job),
+            media_type="application/x-ndjson",
+            headers={"X-Batch-Job-Id": job.id, "Cache-Control": "no-cache"}
+        )
+    
+    @router.post("/batch")
+    async def create_batch(http_request: Request, job_id: Optional[str] = None):
+        """Run a JSONL body of {"message", "conversation_id"?, "id"?} items; results stream back as JSONL.
+        
+        The job keeps running if the client goes away; GET /batch/{job_id}/results
+        picks the stream up again, resuming the job after a restart.
+        """
+        try:
+            items = batch_service.parse((await http_request.body()).decode())
+            job = batch_service.create(items, job_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return batch_response(job)
+    
+    @router.get("/batch/{job_id}")
+    async def get_batch(job_id: str):
+        """Batch job progress"""
+        job = batch_service.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Batch job not found")
+        return job.get_stats()
+    
+    @router.get("/batch/{job_id}/results")
+    async def get_batch_results(job_id: str):
+        """Finished results of a batch job, then the rest as they complete"""
+        job = batch_service.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Batch job not found")
+        return batch_response(job)
+    
+    @router.get("/artifacts/{artifact_id}")
+    async def get_artifact(artifact_id: str, http_request: Request):
+        """A stored rich output; content-addressed, so it is cacheable forever"""
+        path = artifact_store.path(artifact_id)
+        if path is None or not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        headers = {
+            "ETag": f'"{artifact_id}"',
+            "Cache-Control": "public, max-age=31536000, immutable",
+            # HTML and SVG outputs come from user code; never run them on our origin
+            "Content-Security-Policy": "sandbox",
+            "X-Content-Type-Options": "nosniff",
+        }
+        if headers["ETag"] in http_request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        # FileResponse answers Range requests and uses sendfile where the server supports it
+        return FileResponse(path, media_type=artifact_store.media_type(artifact_id), headers=headers)
+    
+    @router.get("/tools")
+    async def list_tools(conversation_id: Optional[str] = None):
+        """Definitions of the tools a conversation (or a new one) can call"""
+        return Response(llm_service.tool_registry.get_tool_definitions_json(conversation_id),
+                        media_type="application/json")
+    
     @router.get("/conversations/{conv_id}", response_model=ConversationHistory)
     async def get_conversation(conv_id: str):
         """Get conversation history"""
-        messages_raw = llm_service.get_conversation(conv_id)
+        messages_raw = await llm_service.get_conversation(conv_id, create=False)
         
         if not messages_raw:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         messages = [
-            ChatMessage(role=msg["role"], content=msg.get("content", ""), timestamp=time.time())
+            ChatMessage(role=msg["role"], content=msg.get("content") or "", timestamp=time.time())
             for msg in messages_raw
             if msg["role"] in ["user", "assistant"]
         ]
@@ -67,17 +189,34 @@ def create_routes(llm_service: LLMService) -> APIRouter:
     @router.get("/conversations")
     async def list_conversations():
         """List all conversations"""
-        return {"conversations": llm_service.list_conversations()}
+        return {"conversations": await llm_service.list_conversations()}
     
     @router.delete("/conversations/{conv_id}")
     async def delete_conversation(conv_id: str):
         """Delete conversation"""
-        llm_service.delete_conversation(conv_id)
+        await llm_service.delete_conversation(conv_id)
         return {"message": "Conversation deleted"}
     
     @router.get("/health")
     async def health_check():
         """Health check endpoint"""
-        return {"status": "healthy", "timestamp": time.time()}
+        return {
+            "status": "healthy",
+            "timestamp": time.time(),
+            "kernels": {
+                "active": jupyter_gateway_service.get_session_count(),
+                "pool": jupyter_gateway_service.get_pool_stats(),
+                "gateways": jupyter_gateway_service.get_gateway_stats()
+            },
+            "prompt_cache": llm_service.slot_allocator.get_stats(),
+            "scheduler": llm_service.scheduler.get_stats(),
+            "turns": llm_service.turns.get_stats(),
+            "tools": llm_service.tool_registry.get_stats()
+        }
+    
+    @router.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        """Metrics in the Prometheus text exposition format"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
     
     return router
\ No newline at end of file
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from typing import AsyncIterator
+from ..core.models import ChatEvent, ContentEvent
+
+def encode_event(event: ChatEvent) -> str:
+    """Serialize an event as one SSE frame, skipping pydantic for content deltas"""
+    if event.__class__ is ContentEvent:
+        return 'data: {"type": "content", "content": ' + json.dumps(event.content) + '}\n\n'
+    return f"data: {json.dumps(event.model_dump(exclude_none=True))}\n\n"
+
+async def coalesce_content(events: AsyncIterator[ChatEvent], interval: float,
+                           max_chars: int) -> AsyncIterator[ChatEvent]:
+    """Merge consecutive content deltas into one event.
+
+    Buffered content is flushed once it is interval seconds old or max_chars
+    long, and before any other event, so ordering is unchanged.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    # Bounds what is queued, so a client that reads slowly holds back the source
+    room = asyncio.Semaphore(64)
+    done = object()
+    
+    async def pump():
+        async with aclosing(events):
+            async for event in events:
+                try:
+                    await room.acquire()
+                except asyncio.CancelledError:
+                    # Cancelled while waiting for the client, by the cancel endpoint or
+                    # because the stream ended: the source decides what that means
+                    event = await events.athrow(asyncio.CancelledError())
+                queue.put_nowait(event)
+    
+    producer = asyncio.create_task(pump())
+    # Never blocks, so the end is signalled however the producer stops
+    producer.add_done_callback(lambda _: queue.put_nowait(done))
+    parts, size, deadline = [], 0, 0.0
+    try:
+        while True:
+            if parts:
+                try:
+                    event = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    yield ContentEvent("".join(parts))
+                    parts, size = [], 0
+                    continue
+            else:
+                event = await queue.get()
+            if event is done:
+                break
+            room.release()
+            
+            if event.__class__ is ContentEvent:
+                if not parts:
+                    deadline = time.monotonic() + interval
+                parts.append(event.content)
+                size += len(event.content)
+                if size >= max_chars:
+                    yield ContentEvent("".join(parts))
+                    parts, size = [], 0
+                continue
+            if parts:
+                yield ContentEvent("".join(parts))
+                parts, size = [], 0
+            yield event
+        if parts:
+            yield ContentEvent("".join(parts))
+        if not producer.cancelled():
+            # Surface errors raised by the source
+            producer.result()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            # Let the source clean up (save the turn, free its slot) before the response ends
+            await asyncio.gather(producer, return_exceptions=True)
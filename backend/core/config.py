@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any
+from typing import Any, Dict, List
 
 class Settings:
     # OpenAI/LLM Configuration
@@ -7,20 +7,116 @@ class Settings:
     OPENAI_KEY: str = os.getenv("OPENAI_KEY", "dummy")
     MODEL_NAME: str = os.getenv("MODEL_NAME", "gpt-oss-20b")
     TEMPERATURE: float = float(os.getenv("TEMPERATURE", "1.0"))
+    # KV-cache slot pinning: set to llama-server's --parallel slot count, 0 disables.
+    # Each slot gets -c / --parallel tokens of context, so size CONTEXT_TOKEN_BUDGET to match.
+    LLAMA_SLOTS: int = int(os.getenv("LLAMA_SLOTS", "0"))
+    # Admission control: completions run at once (defaults to LLAMA_SLOTS) and requests allowed to wait
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", str(LLAMA_SLOTS or 4)))
+    LLM_MAX_QUEUE: int = int(os.getenv("LLM_MAX_QUEUE", "32"))
+    CONVERSATION_MAX_WAITING_TURNS: int = int(os.getenv("CONVERSATION_MAX_WAITING_TURNS", "2"))  # behind the running one
+    # Streams requested with coalesce=true merge content deltas for up to this long / this many chars
+    SSE_COALESCE_INTERVAL: float = float(os.getenv("SSE_COALESCE_INTERVAL", "0.02"))
+    SSE_COALESCE_CHARS: int = int(os.getenv("SSE_COALESCE_CHARS", "256"))
     
     # Jupyter Configuration
     IMAGE: str = os.getenv("IMAGE", "jupyter-uv:latest")
     JUPY_TOKEN: str = os.getenv("JUPY_TOKEN", "token123")
     JUPY_PORT: int = int(os.getenv("JUPY_PORT", "8888"))
+    JUPYTER_GATEWAY_URL: str = os.getenv("JUPYTER_GATEWAY_URL", f"http://jupyter-gateway:{JUPY_PORT}")
+    # Kernels are spread over these gateways, e.g. "http://gw1:8888,http://gw2:8888"
+    JUPYTER_GATEWAY_URLS: List[str] = [
+        url.strip() for url in os.getenv("JUPYTER_GATEWAY_URLS", JUPYTER_GATEWAY_URL).split(",") if url.strip()
+    ]
+    JUPYTER_GATEWAY_HEALTH_INTERVAL: float = float(os.getenv("JUPYTER_GATEWAY_HEALTH_INTERVAL", "10"))
+    JUPYTER_GATEWAY_MAX_FAILURES: int = int(os.getenv("JUPYTER_GATEWAY_MAX_FAILURES", "2"))  # failed checks before failover
+    JUPYTER_WS_PING_INTERVAL: float = float(os.getenv("JUPYTER_WS_PING_INTERVAL", "20"))
+    JUPYTER_WS_PING_TIMEOUT: float = float(os.getenv("JUPYTER_WS_PING_TIMEOUT", "20"))
+    JUPYTER_WS_MAX_RETRIES: int = int(os.getenv("JUPYTER_WS_MAX_RETRIES", "5"))
     
     # Session Management
-    JUPYTER_SESSION_TTL: int = int(os.getenv("JUPYTER_SESSION_TTL", "7200"))  # 2 hours
-    GC_INTERVAL: int = int(os.getenv("GC_INTERVAL", "300"))   # 5 minutes
+    JUPYTER_SESSION_TTL: int = int(os.getenv("JUPYTER_SESSION_TTL", "7200"))  # 2 hours idle before reaping
+    KERNEL_MAX_LIVE: int = int(os.getenv("KERNEL_MAX_LIVE", "64"))  # hard cap incl. pool, LRU idle evicted, 0 unlimited
+    KERNEL_DELETE_CONCURRENCY: int = int(os.getenv("KERNEL_DELETE_CONCURRENCY", "8"))
+    KERNEL_INTERRUPT_TIMEOUT: float = float(os.getenv("KERNEL_INTERRUPT_TIMEOUT", "10"))  # wait for an abandoned cell to stop
+    
+    # Kernel Hibernation (pickle the namespace of idle/evicted kernels, restore on next use)
+    KERNEL_HIBERNATE: bool = os.getenv("KERNEL_HIBERNATE", "false").lower() == "true"
+    KERNEL_HIBERNATE_DIR: str = os.getenv("KERNEL_HIBERNATE_DIR", "/workspace/.hibernate")  # path inside the kernel
+    KERNEL_HIBERNATE_TIMEOUT: float = float(os.getenv("KERNEL_HIBERNATE_TIMEOUT", "60"))
+    KERNEL_HIBERNATE_MAX_BYTES: int = int(os.getenv("KERNEL_HIBERNATE_MAX_BYTES", str(512 * 1024 * 1024)))
+    
+    # Kernel Pool (pre-started kernels handed out on first python call)
+    KERNEL_POOL_LOW: int = int(os.getenv("KERNEL_POOL_LOW", "1"))     # refill below this
+    KERNEL_POOL_HIGH: int = int(os.getenv("KERNEL_POOL_HIGH", "2"))   # refill up to this, 0 disables
+    KERNEL_POOL_PREIMPORT: str = os.getenv("KERNEL_POOL_PREIMPORT", "")  # e.g. "import numpy, pandas"
+    KERNEL_POOL_RETRY_DELAY: float = float(os.getenv("KERNEL_POOL_RETRY_DELAY", "5"))
+    
+    # Conversation Storage
+    CONVERSATION_STORE: str = os.getenv("CONVERSATION_STORE", "sqlite")  # sqlite or memory
+    CONVERSATION_DB_PATH: str = os.getenv("CONVERSATION_DB_PATH", "./data/conversations.db")
+    CONVERSATION_CACHE_SIZE: int = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))  # hot conversations kept in memory
+    CONVERSATION_FLUSH_INTERVAL: float = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5"))  # write-behind delay
+    
+    # Shared State (several workers or replicas on one host / shared volume)
+    # Conversations and the conversation -> kernel mapping live in CONVERSATION_DB_PATH instead of process memory.
+    # LLM_MAX_CONCURRENCY, KERNEL_MAX_LIVE and turn ordering (CONVERSATION_MAX_WAITING_TURNS) stay per worker.
+    SHARED_STATE: bool = os.getenv("SHARED_STATE", "false").lower() == "true"
+    KERNEL_CLAIM_TIMEOUT: float = float(os.getenv("KERNEL_CLAIM_TIMEOUT", "120"))  # a worker starting/hibernating a kernel is presumed dead after this
+    
+    # Context Window (token estimates, llama-server runs with -c 65536)
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "48000"))  # prompt budget, leaves room to generate
+    CONTEXT_TARGET_RATIO: float = float(os.getenv("CONTEXT_TARGET_RATIO", "0.75"))  # trim down to this share of the budget
+    CONTEXT_KEEP_TURNS: int = int(os.getenv("CONTEXT_KEEP_TURNS", "4"))  # recent turns never trimmed
+    CONTEXT_TOOL_OUTPUT_CHARS: int = int(os.getenv("CONTEXT_TOOL_OUTPUT_CHARS", "2000"))  # old tool outputs cut to this
+    CONTEXT_CHARS_PER_TOKEN: int = int(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+    CONTEXT_SUMMARIZE: bool = os.getenv("CONTEXT_SUMMARIZE", "false").lower() == "true"
+    
+    # Batch Jobs (/api/batch runs at batch priority; results are appended to BATCH_DIR as they finish)
+    BATCH_DIR: str = os.getenv("BATCH_DIR", "./data/batches")
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "4"))  # items of one job in flight
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "100000"))
+    
+    # Tool Execution
+    TOOLS: List[str] = [name.strip() for name in os.getenv("TOOLS", "").split(",") if name.strip()]  # default set, empty for all
+    TOOL_PLUGINS: Dict[str, str] = {  # extra tools, e.g. "sql=mypackage.sql_tool:SQLTool"
+        name.strip(): target.strip()
+        for name, target in (
+            item.split("=", 1) for item in os.getenv("TOOL_PLUGINS", "").split(",") if item.strip()
+        )
+    }
+    TOOL_MAX_CONCURRENCY: int = int(os.getenv("TOOL_MAX_CONCURRENCY", "8"))
+    TOOL_CONCURRENCY: Dict[str, int] = {  # per-tool overrides, e.g. "python=4,browser=8"
+        name.strip(): int(limit)
+        for name, limit in (
+            item.split("=") for item in os.getenv("TOOL_CONCURRENCY", "").split(",") if item.strip()
+        )
+    }
+    
+    TOOL_RESULT_PREVIEW_CHARS: int = int(os.getenv("TOOL_RESULT_PREVIEW_CHARS", "200"))  # tool_result event size
+    TOOL_OUTPUT_HEAD_CHARS: int = int(os.getenv("TOOL_OUTPUT_HEAD_CHARS", "2000"))  # kept from the start of each stream
+    TOOL_OUTPUT_TAIL_CHARS: int = int(os.getenv("TOOL_OUTPUT_TAIL_CHARS", "2000"))  # kept from the end of each stream
+    TOOL_OUTPUT_DIR: str = os.getenv("TOOL_OUTPUT_DIR", "./data/tool_outputs")  # full text of longer outputs
+    TOOL_OUTPUT_SPILL_MAX_CHARS: int = int(os.getenv("TOOL_OUTPUT_SPILL_MAX_CHARS", str(64 * 1024 * 1024)))
+    TOOL_OUTPUT_PAGE_CHARS: int = int(os.getenv("TOOL_OUTPUT_PAGE_CHARS", "4000"))  # default page of the output tool
+    ARTIFACT_DIR: str = os.getenv("ARTIFACT_DIR", "./data/artifacts")  # plots and other rich outputs, by content hash
+    ARTIFACT_MAX_BYTES: int = int(os.getenv("ARTIFACT_MAX_BYTES", str(20 * 1024 * 1024)))  # larger outputs are dropped
+    
+    # Browser Tool
+    BROWSER_POOL_SIZE: int = int(os.getenv("BROWSER_POOL_SIZE", "16"))  # pooled connections per host
+    BROWSER_CACHE_DIR: str = os.getenv("BROWSER_CACHE_DIR", "./data/http_cache")
+    BROWSER_CACHE_MAX_BYTES: int = int(os.getenv("BROWSER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    BROWSER_CACHE_TTL: int = int(os.getenv("BROWSER_CACHE_TTL", "3600"))  # served without revalidation
+    BROWSER_MAX_BYTES: int = int(os.getenv("BROWSER_MAX_BYTES", str(2 * 1024 * 1024)))  # download cap per page
+    BROWSER_OPEN_MAX_CHARS: int = int(os.getenv("BROWSER_OPEN_MAX_CHARS", "2000"))  # default page of text
+    BROWSER_TEXT_CACHE_SIZE: int = int(os.getenv("BROWSER_TEXT_CACHE_SIZE", "256"))  # extracted pages kept
+    BROWSER_SEARCH_CACHE_SIZE: int = int(os.getenv("BROWSER_SEARCH_CACHE_SIZE", "1024"))
+    BROWSER_SEARCH_CACHE_TTL: int = int(os.getenv("BROWSER_SEARCH_CACHE_TTL", "3600"))
     
     # API Configuration
     CORS_ORIGINS: list = ["*"]
     API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
     API_PORT: int = int(os.getenv("API_PORT", "8000"))
+    API_WORKERS: int = int(os.getenv("API_WORKERS", "1"))  # more than 1 requires SHARED_STATE
     
     # Frontend Configuration
     FRONTEND_BUILD_DIR: str = os.getenv("FRONTEND_BUILD_DIR", "./frontend/build")
@@ -0,0 +1,161 @@
+import bisect
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _label_str(names: Sequence[str], values: Sequence[str]) -> str:
+    """Render a label set once, e.g. {tool="python"}"""
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric(ABC):
+    """A metric family; children per label set are bound once and kept"""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+    
+    def labels(self, *values: str):
+        """Get the child for a label set; bind it once outside hot paths and reuse it"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child(_label_str(self.labelnames, values))
+        return child
+    
+    @abstractmethod
+    def _new_child(self, labels: str):
+        """A child for one rendered label set"""
+    
+    def _samples(self) -> List[str]:
+        return [line for child in list(self._children.values()) for line in child.samples(self.name)]
+    
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+class _CounterChild:
+    __slots__ = ("_labels", "value")
+    
+    def __init__(self, labels: str):
+        self._labels = labels
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+    
+    def samples(self, name: str) -> List[str]:
+        return [f"{name}{self._labels} {_fmt(self.value)}"]
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+    
+    kind = "counter"
+    
+    def _new_child(self, labels: str) -> _CounterChild:
+        return _CounterChild(labels)
+    
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ("function",)
+    
+    def __init__(self, labels: str):
+        super().__init__(labels)
+        self.function: Optional[Callable[[], float]] = None
+    
+    def set(self, value: float):
+        self.value = value
+    
+    def dec(self, amount: float = 1):
+        self.value -= amount
+    
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at scrape time instead of tracking it"""
+        self.function = function
+    
+    def samples(self, name: str) -> List[str]:
+        if self.function is not None:
+            self.value = self.function()
+        return super().samples(name)
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+    
+    kind = "gauge"
+    
+    def _new_child(self, labels: str) -> _GaugeChild:
+        return _GaugeChild(labels)
+    
+    def set(self, value: float):
+        self.labels().set(value)
+    
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+class _HistogramChild:
+    __slots__ = ("_labels", "_bucket_labels", "_bounds", "_counts", "sum", "count")
+    
+    def __init__(self, labels: str, bounds: Tuple[float, ...]):
+        self._labels = labels
+        self._bounds = bounds
+        prefix = labels[:-1] + "," if labels else "{"
+        self._bucket_labels = [f'{prefix}le="{_fmt(b)}"}}' for b in bounds + (float("inf"),)]
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def samples(self, name: str) -> List[str]:
+        lines, cumulative = [], 0
+        for labels, count in zip(self._bucket_labels, self._counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        lines.append(f"{name}_sum{self._labels} {_fmt(self.sum)}")
+        lines.append(f"{name}_count{self._labels} {self.count}")
+        return lines
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+    
+    def _new_child(self, labels: str) -> _HistogramChild:
+        return _HistogramChild(labels, self.buckets)
+    
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+REGISTRY: List[_Metric] = []
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 class ChatMessage(BaseModel):
     role: str
@@ -9,6 +9,14 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
+    coalesce: bool = False  # stream: merge content deltas into fewer, larger frames
+    tools: Optional[List[str]] = None  # tools of the conversation from this turn on (while it is recent), default TOOLS
+
+class BatchItem(BaseModel):
+    """One line of a /api/batch JSONL body"""
+    message: str
+    conversation_id: Optional[str] = None  # items sharing a conversation run in order
+    id: Optional[str] = None  # echoed back in the result
 
 class ChatResponse(BaseModel):
     response: str
@@ -24,5 +32,21 @@ class StreamEvent(BaseModel):
     content: Optional[str] = None
     conversation_id: Optional[str] = None
     tool_name: Optional[str] = None
+    tool_call_id: Optional[str] = None
+    stream: Optional[str] = None  # tool_output: stdout, stderr, result or error
     result: Optional[str] = None
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+    artifact: Optional[Dict[str, Any]] = None  # tool_artifact: {"id", "mime", "size", "url"}
+
+class ContentEvent:
+    """Lightweight StreamEvent(type="content") for the per-token hot path"""
+    __slots__ = ("content",)
+    type = "content"
+    
+    def __init__(self, content: str):
+        self.content = content
+    
+    def model_dump(self, exclude_none: bool = False) -> Dict[str, Any]:
+        return {"type": "content", "content": self.content}
+
+ChatEvent = Union[StreamEvent, ContentEvent]
@@ -1,6 +1,5 @@
 import os
-import threading
-import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,13 +7,34 @@ from fastapi.staticfiles import StaticFiles
 from .core.config import settings
 from .services.jupyter_gateway_service import JupyterGatewayService
 from .services.jupyter_service import JupyterService
+from .services.artifact_store import ArtifactStore
 from .services.llm_service import LLMService
+from .services.conversation_store import create_conversation_store
+from .services.batch_service import BatchService
+from .services.kernel_registry import create_kernel_registry
 from .tools.tool_registry import ToolRegistry
 from .api.routes import create_routes
 
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application"""
-    app = FastAPI(title="LocalGPT Orchestrator", version="1.0.0")
+    # Initialize services
+    jupyter_gateway_service = JupyterGatewayService(create_kernel_registry())
+    artifact_store = ArtifactStore(settings.ARTIFACT_DIR, settings.ARTIFACT_MAX_BYTES)
+    jupyter_service = JupyterService(jupyter_gateway_service, artifact_store)
+    tool_registry = ToolRegistry(jupyter_service)
+    conversation_store = create_conversation_store()
+    llm_service = LLMService(tool_registry, conversation_store)
+    batch_service = BatchService(llm_service)
+    
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await jupyter_gateway_service.start()
+        yield
+        await batch_service.stop()
+        await jupyter_gateway_service.stop()
+        conversation_store.close()
+    
+    app = FastAPI(title="LocalGPT Orchestrator", version="1.0.0", lifespan=lifespan)
     
     # CORS middleware
     app.add_middleware(
@@ -25,32 +45,22 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
     
-    # Initialize services
-    jupyter_gateway_service = JupyterGatewayService()
-    jupyter_service = JupyterService(jupyter_gateway_service)
-    tool_registry = ToolRegistry(jupyter_service)
-    llm_service = LLMService(tool_registry)
-    
     # Create and include API routes
-    api_router = create_routes(llm_service)
+    api_router = create_routes(llm_service, jupyter_gateway_service, batch_service, artifact_store)
     app.include_router(api_router, prefix="/api")
     
     # Serve static files for the frontend
     if os.path.exists(settings.FRONTEND_BUILD_DIR):
         app.mount("/", StaticFiles(directory=settings.FRONTEND_BUILD_DIR, html=True), name="frontend")
     
-    # Background garbage collection
-    def background_gc():
-        while True:
-            time.sleep(settings.GC_INTERVAL)
-            jupyter_gateway_service.gc_idle()
-    
-    threading.Thread(target=background_gc, daemon=True).start()
-    
     return app
 
 app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=settings.API_HOST, port=settings.API_PORT)
\ No newline at end of file
+    if settings.API_WORKERS > 1:
+        # Workers import the app themselves; they share state through SHARED_STATE
+        uvicorn.run("backend.main:app", host=settings.API_HOST, port=settings.API_PORT, workers=settings.API_WORKERS)
+    else:
+        uvicorn.run(app, host=settings.API_HOST, port=settings.API_PORT)
\ No newline at end of file
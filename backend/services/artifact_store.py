@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Any, Dict, Optional
+from ..core.metrics import Counter
+
+ARTIFACTS = Counter("localgpt_artifacts_total", "Rich kernel outputs offered to the artifact store, by outcome", ["result"])
+
+# MIME types kept as artifacts, richest first; a bundle is stored as the first it has
+ARTIFACT_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/svg+xml": ".svg",
+    "image/gif": ".gif",
+    "application/pdf": ".pdf",
+    "text/html": ".html",
+}
+MEDIA_TYPES = {ext: mime for mime, ext in ARTIFACT_TYPES.items()}
+# Sent base64-encoded in Jupyter messages
+BINARY_TYPES = {"image/png", "image/jpeg", "image/gif", "application/pdf"}
+
+_ARTIFACT_ID = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+class ArtifactStore:
+    """Content-addressed files for rich kernel outputs such as plots.
+    
+    An artifact's id is the SHA-256 of its content plus the extension of its
+    MIME type, so repeated outputs are stored once and a stored file never
+    changes. Conversations and prompts only carry references.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._outcomes = {result: ARTIFACTS.labels(result) for result in ("stored", "duplicate", "too_large")}
+    
+    def path(self, artifact_id: str) -> Optional[str]:
+        """File of an artifact id, or None if the id is malformed"""
+        if not _ARTIFACT_ID.match(artifact_id) or os.path.splitext(artifact_id)[1] not in MEDIA_TYPES:
+            return None
+        return os.path.join(self.directory, artifact_id[:2], artifact_id)
+    
+    @staticmethod
+    def media_type(artifact_id: str) -> str:
+        return MEDIA_TYPES[os.path.splitext(artifact_id)[1]]
+    
+    def put_bundle(self, bundle: Dict[str, Any]) -> Optional[Dict]:
+        """Store the richest supported entry of a MIME bundle, returning its reference"""
+        for mime in ARTIFACT_TYPES:
+            if mime in bundle:
+                return self.put(mime, bundle[mime])
+        return None
+    
+    def put(self, mime: str, value: Any) -> Optional[Dict]:
+        """Store one MIME bundle entry, or None if it is too large"""
+        if mime in BINARY_TYPES:
+            data = base64.b64decode(value)
+        elif isinstance(value, str):
+            data = value.encode()
+        elif isinstance(value, list):
+            # Jupyter may split text into lines
+            data = "".join(value).encode()
+        else:
+            data = json.dumps(value).encode()
+        if len(data) > self.max_bytes:
+            self._outcomes["too_large"].inc()
+            return None
+        
+        artifact_id = hashlib.sha256(data).hexdigest() + ARTIFACT_TYPES[mime]
+        path = self.path(artifact_id)
+        if os.path.exists(path):
+            self._outcomes["duplicate"].inc()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._outcomes["stored"].inc()
+        return {"id": artifact_id, "mime": mime, "size": len(data), "url": f"/api/artifacts/{artifact_id}"}
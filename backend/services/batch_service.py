@@ -0,0 +1,259 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, TextIO
+from ..core.config import settings
+from ..core.metrics import Counter
+from ..core.models import BatchItem
+from .llm_service import LLMService
+from .scheduler import PRIORITY_BATCH, ConversationBusyError, QueueFullError
+
+BATCH_ITEMS = Counter("localgpt_batch_items_total", "Batch items finished, by outcome", ["result"])
+
+_JOB_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class BatchJob:
+    """A batch's items and the results finished so far.
+    
+    The items are written to <id>.input.jsonl when the job is created and every
+    result is appended to <id>.results.jsonl as it finishes, so a restarted job
+    only runs what is missing. The worker running a job holds an exclusive lock
+    on its results file.
+    """
+    
+    def __init__(self, job_id: str, directory: str, items: List[BatchItem]):
+        self.id = job_id
+        self.items = items
+        self.input_path = os.path.join(directory, f"{job_id}.input.jsonl")
+        self.results_path = os.path.join(directory, f"{job_id}.results.jsonl")
+        self.results: Dict[int, Dict] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._listeners: List[asyncio.Queue] = []
+        self._file: Optional[TextIO] = None
+        # Serializes appends, and closing the file, with the threads writing to it
+        self._file_lock = threading.Lock()
+    
+    @property
+    def finished(self) -> bool:
+        return len(self.results) >= len(self.items)
+    
+    def load_results(self, offset: int = 0) -> int:
+        """Read results persisted from offset on, returning the offset to continue from"""
+        if not os.path.exists(self.results_path):
+            return offset
+        with open(self.results_path) as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    # Torn write from a crash, or one still in progress elsewhere
+                    return offset
+                result = json.loads(line)
+                self.results[result["index"]] = result
+                offset = f.tell()
+    
+    def lock(self) -> bool:
+        """Take over the job unless another worker is running it"""
+        self._file = open(self.results_path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        # Truncate a torn last line so appends start on a line boundary
+        offset = self.load_results()
+        self._file.truncate(offset)
+        return True
+    
+    def release(self):
+        """Give the job up and wake everyone following it"""
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        for queue in self._listeners:
+            queue.put_nowait(None)
+    
+    async def record(self, result: Dict):
+        """Persist a finished result, then hand it to everyone following the job"""
+        await asyncio.to_thread(self._append, json.dumps(result) + "\n")
+        self.results[result["index"]] = result
+        for queue in self._listeners:
+            queue.put_nowait(result)
+    
+    def _append(self, line: str):
+        with self._file_lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+    
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._listeners.append(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._listeners.remove(queue)
+    
+    def get_stats(self) -> Dict:
+        errors = sum(1 for r in self.results.values() if "error" in r)
+        return {
+            "job_id": self.id,
+            "total": len(self.items),
+            "done": len(self.results),
+            "errors": errors,
+            "running": self.task is not None and not self.task.done()
+        }
+
+class BatchService:
+    """Runs batch jobs through LLMService at batch priority, BATCH_CONCURRENCY items at a time"""
+    
+    def __init__(self, llm_service: LLMService):
+        self.llm_service = llm_service
+        self.directory = settings.BATCH_DIR
+        self._jobs: Dict[str, BatchJob] = {}
+        self._done = {result: BATCH_ITEMS.labels(result) for result in ("ok", "error")}
+        os.makedirs(self.directory, exist_ok=True)
+    
+    @staticmethod
+    def parse(body: str) -> List[BatchItem]:
+        """Parse a JSONL body, raising ValueError with the line number of a bad item"""
+        items = []
+        for number, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(BatchItem.model_validate_json(line))
+            except ValueError as e:
+                raise ValueError(f"Line {number}: {e}")
+        if not items:
+            raise ValueError("No items")
+        if len(items) > settings.BATCH_MAX_ITEMS:
+            raise ValueError(f"Too many items ({len(items)} > {settings.BATCH_MAX_ITEMS})")
+        return items
+    
+    def create(self, items: List[BatchItem], job_id: Optional[str] = None) -> BatchJob:
+        """Persist a new job and start it; raises ValueError for a bad or taken id"""
+        job_id = job_id or f"batch-{uuid.uuid4().hex[:12]}"
+        if not _JOB_ID.match(job_id):
+            raise ValueError("Job id may only contain letters, digits, '-' and '_'")
+        job = BatchJob(job_id, self.directory, items)
+        try:
+            with open(job.input_path, "x") as f:
+                f.writelines(item.model_dump_json(exclude_none=True) + "\n" for item in items)
+        except FileExistsError:
+            raise ValueError(f"Job {job_id} already exists")
+        self._jobs[job_id] = job
+        self.resume(job)
+        return job
+    
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """A job of this worker, or one loaded from disk (e.g. after a restart)"""
+        job = self._jobs.get(job_id)
+        if job is not None or not _JOB_ID.match(job_id):
+            return job
+        job = BatchJob(job_id, self.directory, [])
+        try:
+            with open(job.input_path) as f:
+                job.items = [BatchItem.model_validate_json(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+        job.load_results()
+        self._jobs[job_id] = job
+        return job
+    
+    def resume(self, job: BatchJob) -> bool:
+        """Run the job's missing items here unless it is finished or running elsewhere"""
+        if job.task is not None and not job.task.done():
+            return True
+        if job.finished or not job.lock():
+            return False
+        job.task = asyncio.create_task(self._run(job))
+        return True
+    
+    async def _run(self, job: BatchJob):
+        # Items of one conversation form a chain that runs in input order
+        chains: Dict[str, Deque[int]] = {}
+        for index, item in enumerate(job.items):
+            if index not in job.results:
+                chains.setdefault(item.conversation_id or f"#{index}", deque()).append(index)
+        pending = deque(chains.values())
+        
+        async def worker():
+            while pending:
+                chain = pending.popleft()
+                for index in chain:
+                    await job.record(await self._run_item(job, index))
+        
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(settings.BATCH_CONCURRENCY, len(pending)))))
+        finally:
+            job.release()
+    
+    async def _run_item(self, job: BatchJob, index: int) -> Dict:
+        item = job.items[index]
+        # Standalone items get a throwaway conversation
+        conv_id = item.conversation_id or f"{job.id}-{index}"
+        result = {"index": index, "id": item.id, "conversation_id": item.conversation_id}
+        started = time.perf_counter()
+        while True:
+            try:
+                result["response"] = await self.llm_service.chat_sync(conv_id, item.message, priority=PRIORITY_BATCH)
+                self._done["ok"].inc()
+                break
+            except (QueueFullError, ConversationBusyError) as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                result["error"] = str(e)
+                self._done["error"].inc()
+                break
+        if item.conversation_id is None:
+            await self.llm_service.delete_conversation(conv_id)
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        return result
+    
+    async def results(self, job: BatchJob) -> AsyncIterator[Dict]:
+        """Yield finished results, then the rest as they complete, in completion order.
+        
+        An unfinished job that is not running anywhere is resumed here; one
+        running in another worker is followed through its results file.
+        """
+        sent = set()
+        offset = 0  # how far this follower has read the results file
+        while True:
+            queue = job.subscribe() if self.resume(job) else None
+            try:
+                for result in list(job.results.values()):
+                    if result["index"] not in sent:
+                        sent.add(result["index"])
+                        yield result
+                if job.finished:
+                    return
+                if queue is None:
+                    await asyncio.sleep(1)
+                    offset = job.load_results(offset)
+                    continue
+                while True:
+                    result = await queue.get()
+                    if result is None:
+                        return  # finished, or stopped and resumable later
+                    if result["index"] not in sent:
+                        sent.add(result["index"])
+                        yield result
+            finally:
+                if queue is not None:
+                    job.unsubscribe(queue)
+    
+    async def stop(self):
+        """Stop running jobs; they continue from their results file when resumed"""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
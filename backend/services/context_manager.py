@@ -0,0 +1,154 @@
+import json
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from ..core.config import settings
+
+# Turns an old slice of a conversation (by id) into a short textual summary
+Summarizer = Callable[[str, List[Dict]], Awaitable[str]]
+
+class _ConversationContext:
+    """Per-conversation context state: cached token counts and trim points"""
+    
+    def __init__(self):
+        self.counts: List[Tuple[Tuple, int]] = []  # (fingerprint, token estimate) per message, in order
+        self.compressed_turns = 0     # tool outputs of turns before this are compressed
+        self.dropped_turns = 0        # turns before this are left out of the prompt
+        self.summary: Optional[str] = None
+        self.summary_turns = 0        # dropped_turns the summary covers
+
+class ContextManager:
+    """Keeps the prompt sent to the LLM within a token budget.
+    
+    The system prompt and the most recent turns are always kept. When the
+    conversation outgrows the budget, tool outputs of older turns are compressed
+    first, then the oldest turns are dropped (optionally replaced by a summary)
+    until the prompt is back under the target size. Trim points only ever move
+    forward, so the prompt prefix stays byte-stable between trims.
+    """
+    
+    def __init__(self, summarizer: Optional[Summarizer] = None):
+        self.summarizer = summarizer if settings.CONTEXT_SUMMARIZE else None
+        self._contexts: "OrderedDict[str, _ConversationContext]" = OrderedDict()
+    
+    def _context(self, conv_id: str) -> _ConversationContext:
+        ctx = self._contexts.get(conv_id)
+        if ctx is None:
+            ctx = self._contexts[conv_id] = _ConversationContext()
+            if len(self._contexts) > settings.CONVERSATION_CACHE_SIZE:
+                self._contexts.popitem(last=False)
+        else:
+            self._contexts.move_to_end(conv_id)
+        return ctx
+    
+    def forget(self, conv_id: str):
+        """Drop cached state for a deleted conversation"""
+        self._contexts.pop(conv_id, None)
+    
+    @staticmethod
+    def estimate_tokens(message: Dict) -> int:
+        """Cheap token estimate for one chat message"""
+        chars = len(message.get("content") or "")
+        for call in message.get("tool_calls") or []:
+            function = call.get("function", {})
+            chars += len(function.get("name", "")) + len(function.get("arguments") or "")
+        return chars // settings.CONTEXT_CHARS_PER_TOKEN + 4
+    
+    @staticmethod
+    def _fingerprint(message: Dict) -> Tuple:
+        """Cheap stand-in for a message's content, telling when a cached estimate is stale"""
+        content = message.get("content") or ""
+        return message.get("role"), len(content), content[-16:], len(message.get("tool_calls") or [])
+    
+    def _counts(self, ctx: _ConversationContext, messages: List[Dict]) -> List[int]:
+        """Token estimates for messages, computing only ones new or changed since last seen.
+        
+        A message can change in place, e.g. when a cancelled turn is saved
+        with its partial answer, so cached estimates are matched by fingerprint.
+        """
+        cached = ctx.counts
+        del cached[len(messages):]
+        counts = []
+        for i, message in enumerate(messages):
+            fingerprint = self._fingerprint(message)
+            if i == len(cached):
+                cached.append((fingerprint, self.estimate_tokens(message)))
+            elif cached[i][0] != fingerprint:
+                cached[i] = (fingerprint, self.estimate_tokens(message))
+            counts.append(cached[i][1])
+        return counts
+    
+    def token_count(self, conv_id: str, messages: List[Dict]) -> int:
+        """Token estimate for the full, untrimmed conversation"""
+        return sum(self._counts(self._context(conv_id), messages))
+    
+    @staticmethod
+    def _compress(message: Dict) -> Dict:
+        """Shorten a tool output, keeping its head"""
+        content = message.get("content") or ""
+        limit = settings.CONTEXT_TOOL_OUTPUT_CHARS
+        if message.get("role") != "tool" or len(content) <= limit:
+            return message
+        return {**message, "content": f"{content[:limit]}\n[... {len(content) - limit} characters omitted]"}
+    
+    async def build(self, conv_id: str, messages: List[Dict]) -> List[Dict]:
+        """Return the messages to send for this conversation, trimmed to the budget"""
+        ctx = self._context(conv_id)
+        counts = self._counts(ctx, messages)
+        budget = settings.CONTEXT_TOKEN_BUDGET
+        if ctx.dropped_turns == 0 and ctx.compressed_turns == 0 and sum(counts) <= budget:
+            return messages
+        
+        # Turns start at user messages; everything before the first one is the preamble
+        starts = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+        if not starts:
+            return messages
+        preamble = list(range(starts[0]))
+        bounds = list(zip(starts, starts[1:] + [len(messages)]))
+        protected = max(len(bounds) - settings.CONTEXT_KEEP_TURNS, 0)
+        
+        def turn_tokens(t: int) -> int:
+            lo, hi = bounds[t]
+            if t < ctx.compressed_turns:
+                return sum(self.estimate_tokens(self._compress(m)) for m in messages[lo:hi])
+            return sum(counts[lo:hi])
+        
+        def total() -> int:
+            summary = self.estimate_tokens({"content": ctx.summary}) if ctx.summary else 0
+            return (sum(counts[i] for i in preamble) + summary +
+                    sum(turn_tokens(t) for t in range(ctx.dropped_turns, len(bounds))))
+        
+        if total() > budget:
+            target = int(budget * settings.CONTEXT_TARGET_RATIO)
+            ctx.compressed_turns = max(ctx.compressed_turns, protected)
+            while total() > target and ctx.dropped_turns < protected:
+                ctx.dropped_turns += 1
+        
+        if self.summarizer and ctx.dropped_turns > ctx.summary_turns:
+            lo, hi = bounds[ctx.summary_turns][0], bounds[ctx.dropped_turns - 1][1]
+            previous = [{"role": "system", "content": ctx.summary}] if ctx.summary else []
+            try:
+                ctx.summary = await self.summarizer(conv_id, previous + messages[lo:hi])
+                ctx.summary_turns = ctx.dropped_turns
+            except Exception:
+                pass
+        
+        trimmed = [messages[i] for i in preamble]
+        if ctx.summary:
+            trimmed.append({"role": "system", "content": f"Summary of the earlier conversation:\n{ctx.summary}"})
+        for t in range(ctx.dropped_turns, len(bounds)):
+            lo, hi = bounds[t]
+            if t < ctx.compressed_turns:
+                trimmed.extend(self._compress(m) for m in messages[lo:hi])
+            else:
+                trimmed.extend(messages[lo:hi])
+        return trimmed
+
+def summarize_prompt(messages: List[Dict]) -> List[Dict]:
+    """Build the request used to summarise a slice of conversation"""
+    transcript = "\n".join(
+        f"{m.get('role')}: {m.get('content') or json.dumps(m.get('tool_calls'))}" for m in messages
+    )
+    return [
+        {"role": "system", "content": "Summarise the conversation below in a few sentences. Keep facts, decisions, variable names and results the assistant may need later."},
+        {"role": "user", "content": transcript}
+    ]
@@ -0,0 +1,338 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from ..core.config import settings
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        message_count INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated);
+    CREATE TABLE IF NOT EXISTS messages (
+        conv_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (conv_id, seq)
+    ) WITHOUT ROWID;
+"""
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Open a WAL-mode connection in autocommit mode, creating the directory if needed"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+@contextmanager
+def immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Take the database write lock up front so read-then-write is atomic across processes"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+class ConversationStore(ABC):
+    """Interface for conversation history storage; messages are only ever appended"""
+    
+    @abstractmethod
+    def get(self, conv_id: str) -> Optional[List[Dict]]:
+        """Get a copy of the conversation's messages, or None if it does not exist"""
+    
+    @abstractmethod
+    def append(self, conv_id: str, messages: List[Dict]):
+        """Append messages to a conversation, creating it if needed"""
+    
+    @abstractmethod
+    def delete(self, conv_id: str):
+        """Delete a conversation"""
+    
+    @abstractmethod
+    def list_ids(self) -> List[str]:
+        """List conversation IDs, most recently updated first"""
+    
+    def close(self):
+        """Flush pending writes and release resources"""
+
+class MemoryConversationStore(ConversationStore):
+    """Process-local store; conversations are lost on restart"""
+    
+    def __init__(self):
+        self._conversations: "OrderedDict[str, List[Dict]]" = OrderedDict()
+    
+    def get(self, conv_id: str) -> Optional[List[Dict]]:
+        messages = self._conversations.get(conv_id)
+        return list(messages) if messages is not None else None
+    
+    def append(self, conv_id: str, messages: List[Dict]):
+        self._conversations.setdefault(conv_id, []).extend(messages)
+        self._conversations.move_to_end(conv_id)
+    
+    def delete(self, conv_id: str):
+        self._conversations.pop(conv_id, None)
+    
+    def list_ids(self) -> List[str]:
+        return list(reversed(self._conversations))
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite (WAL) store with a bounded LRU of hot conversations and write-behind.
+    
+    Appends land in the LRU immediately and are flushed to SQLite in batches by a
+    writer thread, so the request path never waits on the disk. Conversations
+    with unflushed messages are pinned in the cache until their batch commits.
+    """
+    
+    def __init__(self, path: str, cache_size: int = 256, flush_interval: float = 0.5):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._dirty: Dict[str, int] = {}      # conv_id -> index of first unflushed message
+        self._flushing: Set[str] = set()      # conv_ids in the batch being committed
+        self._deleted: Set[str] = set()       # deletes not yet picked up by the writer
+        self._deleting: Set[str] = set()      # deletes in the batch being committed
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        self._reader = self._connect()
+        self._reader.executescript(_SCHEMA)
+        
+        self._wake = threading.Event()
+        self._stopped = False
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self.path)
+    
+    def _load(self, conv_id: str) -> Optional[List[Dict]]:
+        """Get a conversation into the cache; caller holds the lock"""
+        messages = self._cache.get(conv_id)
+        if messages is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(conv_id)
+            return messages
+        
+        self.cache_misses += 1
+        if conv_id in self._deleted or conv_id in self._deleting:
+            return None
+        rows = self._reader.execute(
+            "SELECT data FROM messages WHERE conv_id = ? ORDER BY seq", (conv_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        messages = [json.loads(data) for (data,) in rows]
+        self._cache[conv_id] = messages
+        self._evict()
+        return messages
+    
+    def _evict(self):
+        """Drop least recently used clean conversations beyond the cache size"""
+        if len(self._cache) <= self.cache_size:
+            return
+        for conv_id in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if conv_id not in self._dirty and conv_id not in self._flushing:
+                del self._cache[conv_id]
+    
+    def get(self, conv_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            messages = self._load(conv_id)
+            return list(messages) if messages is not None else None
+    
+    def append(self, conv_id: str, messages: List[Dict]):
+        if not messages:
+            return
+        with self._lock:
+            cached = self._load(conv_id)
+            if cached is None:
+                cached = self._cache[conv_id] = []
+            self._dirty.setdefault(conv_id, len(cached))
+            cached.extend(messages)
+            self._evict()
+    
+    def delete(self, conv_id: str):
+        with self._lock:
+            self._cache.pop(conv_id, None)
+            self._dirty.pop(conv_id, None)
+            self._deleted.add(conv_id)
+        self._wake.set()
+    
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            pending = [c for c in reversed(self._cache) if c in self._dirty or c in self._flushing]
+            deleted = self._deleted | self._deleting
+            rows = self._reader.execute("SELECT id FROM conversations ORDER BY updated DESC").fetchall()
+        seen = set(pending)
+        return pending + [c for (c,) in rows if c not in seen and c not in deleted]
+    
+    def _write_loop(self):
+        writer = self._connect()
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush(writer)
+        self._flush(writer)
+        writer.close()
+    
+    def _flush(self, conn: sqlite3.Connection):
+        """Commit all pending appends and deletes in one transaction"""
+        with self._lock:
+            deleted = self._deleting = self._deleted
+            self._deleted = set()
+            batch = {conv_id: (start, self._cache[conv_id][start:]) for conv_id, start in self._dirty.items()}
+            totals = {conv_id: len(self._cache[conv_id]) for conv_id in batch}
+            self._dirty = {}
+            self._flushing = set(batch)
+        
+        if not batch and not deleted:
+            return
+        
+        now = time.time()
+        rows = [
+            (conv_id, start + i, json.dumps(msg, default=str))
+            for conv_id, (start, msgs) in batch.items()
+            for i, msg in enumerate(msgs)
+        ]
+        conn.execute("BEGIN")
+        try:
+            for conv_id in deleted:
+                conn.execute("DELETE FROM messages WHERE conv_id = ?", (conv_id,))
+                conn.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+            conn.executemany("INSERT OR REPLACE INTO messages (conv_id, seq, data) VALUES (?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO conversations (id, created, updated, message_count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated = excluded.updated, message_count = excluded.message_count",
+                [(conv_id, now, now, total) for conv_id, total in totals.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            # Put the batch back so the next flush retries it
+            with self._lock:
+                self._deleted |= deleted
+                for conv_id, (start, _) in batch.items():
+                    if conv_id in self._cache:
+                        self._dirty[conv_id] = min(start, self._dirty.get(conv_id, start))
+                self._flushing = set()
+                self._deleting = set()
+            return
+        
+        with self._lock:
+            self._flushing = set()
+            self._deleting = set()
+            self._evict()
+    
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        self._writer.join()
+        self._reader.close()
+
+class SharedSQLiteConversationStore(ConversationStore):
+    """SQLite store shared by several worker processes.
+    
+    Appends are written through in IMMEDIATE transactions that number the new
+    messages after the stored count, so workers appending to one conversation
+    never collide. Cached conversations are checked against the stored
+    (created, message_count) on every read and only the missing tail is loaded.
+    """
+    
+    def __init__(self, path: str, cache_size: int = 256):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()  # conv_id -> (created, messages)
+        self._conn = connect_sqlite(path)
+        self._conn.executescript(_SCHEMA)
+    
+    def get(self, conv_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created, message_count FROM conversations WHERE id = ?", (conv_id,)
+            ).fetchone()
+            if row is None:
+                self._cache.pop(conv_id, None)
+                return None
+            created, count = row
+            cached = self._cache.get(conv_id)
+            if cached is None or cached[0] != created or len(cached[1]) > count:
+                cached = (created, [])
+            messages = cached[1]
+            if len(messages) < count:
+                rows = self._conn.execute(
+                    "SELECT data FROM messages WHERE conv_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                    (conv_id, len(messages), count)
+                ).fetchall()
+                messages.extend(json.loads(data) for (data,) in rows)
+            self._cache[conv_id] = cached
+            self._cache.move_to_end(conv_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return list(messages)
+    
+    def append(self, conv_id: str, messages: List[Dict]):
+        if not messages:
+            return
+        now = time.time()
+        rows = [json.dumps(msg, default=str) for msg in messages]
+        with self._lock:
+            with immediate_transaction(self._conn) as conn:
+                row = conn.execute(
+                    "SELECT created, message_count FROM conversations WHERE id = ?", (conv_id,)
+                ).fetchone()
+                created, count = row if row is not None else (now, 0)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages (conv_id, seq, data) VALUES (?, ?, ?)",
+                    [(conv_id, count + i, data) for i, data in enumerate(rows)]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversations (id, created, updated, message_count) VALUES (?, ?, ?, ?)",
+                    (conv_id, created, now, count + len(rows))
+                )
+            cached = self._cache.get(conv_id)
+            if cached is not None and cached[0] == created and len(cached[1]) == count:
+                cached[1].extend(messages)
+    
+    def delete(self, conv_id: str):
+        with self._lock:
+            with immediate_transaction(self._conn) as conn:
+                conn.execute("DELETE FROM messages WHERE conv_id = ?", (conv_id,))
+                conn.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+            self._cache.pop(conv_id, None)
+    
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM conversations ORDER BY updated DESC").fetchall()
+        return [c for (c,) in rows]
+    
+    def close(self):
+        self._conn.close()
+
+def create_conversation_store() -> ConversationStore:
+    """Build the conversation store selected by CONVERSATION_STORE, or the shared one with SHARED_STATE"""
+    if settings.SHARED_STATE:
+        return SharedSQLiteConversationStore(settings.CONVERSATION_DB_PATH, cache_size=settings.CONVERSATION_CACHE_SIZE)
+    if settings.CONVERSATION_STORE == "memory":
+        return MemoryConversationStore()
+    return SQLiteConversationStore(
+        settings.CONVERSATION_DB_PATH,
+        cache_size=settings.CONVERSATION_CACHE_SIZE,
+        flush_interval=settings.CONVERSATION_FLUSH_INTERVAL
+    )
@@ -1,76 +1,637 @@
+import asyncio
+import heapq
 import time
-import requests
-from urllib.parse import urljoin
-from typing import Dict
+import uuid
+import weakref
+import httpx
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from ..core.config import settings
+from ..core.metrics import Counter, Gauge, Histogram
+from .kernel_registry import ADOPT, CLAIMED, KernelRegistry
+
+KERNEL_CREATE_SECONDS = Histogram("localgpt_kernel_create_seconds", "Time to start a kernel in the Jupyter gateway")
+KERNELS_ACTIVE = Gauge("localgpt_kernels_active", "Kernels assigned to conversations")
+KERNEL_POOL_IDLE = Gauge("localgpt_kernel_pool_idle", "Started kernels waiting in the pool")
+KERNEL_POOL_ACQUIRED = Counter("localgpt_kernel_pool_acquired_total", "Kernel requests served from the pool or not", ["result"])
+KERNELS_REMOVED = Counter("localgpt_kernels_removed_total", "Conversation kernels shut down, by reason", ["reason"])
+KERNEL_SNAPSHOT_SECONDS = Histogram("localgpt_kernel_snapshot_seconds", "Time to hibernate a kernel's namespace to disk")
+KERNEL_INTERRUPTS = Counter("localgpt_kernel_interrupts_total", "Executions interrupted because nobody waits for them anymore")
+GATEWAY_UP = Gauge("localgpt_jupyter_gateway_up", "Whether a Jupyter gateway passes health checks", ["gateway"])
+GATEWAY_KERNELS = Gauge("localgpt_jupyter_gateway_kernels", "Kernels running in a Jupyter gateway, as last seen", ["gateway"])
+
+# Hooks run in the kernel: snapshot before an idle shutdown, restore into a fresh kernel
+Snapshotter = Callable[[str, Dict], Awaitable[None]]
+Restorer = Callable[[str, Dict], Awaitable[None]]
+
+class KernelCapacityError(Exception):
+    """Raised when every live kernel is busy and KERNEL_MAX_LIVE is reached"""
+
+class Gateway:
+    """A Jupyter gateway and what is known about its health and load"""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.failures = 0  # consecutive failed checks
+        self.kernels = 0   # from the last check, adjusted for kernels started and deleted since
+        self.orphans: List[Dict] = []  # kernels dropped while it was down, deleted once it is back
+    
+    def get_stats(self) -> Dict:
+        return {"url": self.url, "healthy": self.healthy, "kernels": self.kernels}
 
 class JupyterGatewayService:
-    def __init__(self):
-        self.gateway_url = f"http://jupyter-gateway:{settings.JUPY_PORT}"
-        self._kernels: Dict[str, Dict] = {}
+    """Owns the kernels of all conversations in the Jupyter gateway.
     
-    def ensure_kernel(self, conv_id: str) -> Dict:
-        """Ensure a kernel exists for the conversation"""
-        kernel_info = self._kernels.get(conv_id)
-        if kernel_info:
-            kernel_info["last_used"] = time.time()
-            return kernel_info
+    State is only touched from the event loop and no await separates a check
+    from the update it guards, so ensure_kernel, the reaper and eviction never
+    see each other half-done. Idle kernels are reaped by a task that sleeps
+    until the earliest deadline in a heap keyed by last_used; above
+    KERNEL_MAX_LIVE the least recently used idle kernel is evicted. With
+    hibernation hooks set, reaped and evicted kernels snapshot their namespace
+    first and the conversation's next kernel restores it.
+    
+    Kernels are placed on the healthy gateway with the fewest kernels and a
+    conversation stays on its kernel's gateway. A gateway failing
+    JUPYTER_GATEWAY_MAX_FAILURES checks in a row is taken out of placement and
+    its conversations get a new kernel elsewhere on their next call.
+    
+    With a shared KernelRegistry, workers in other processes see the same
+    mapping: a kernel is started by whichever worker claims the conversation
+    first, adopted by the rest, and only retired once no worker is using it.
+    Registry calls run in a thread, except the ones that guard retiring a
+    kernel, which must not be separated from it by an await.
+    """
+    
+    def __init__(self, registry: Optional[KernelRegistry] = None):
+        self._gateways: Dict[str, Gateway] = {url: Gateway(url) for url in settings.JUPYTER_GATEWAY_URLS}
+        self._health_task: Optional[asyncio.Task] = None
+        self.ttl = settings.JUPYTER_SESSION_TTL
+        self.max_live = settings.KERNEL_MAX_LIVE
+        self._registry = registry
+        self._kernels: "OrderedDict[str, Dict]" = OrderedDict()  # conv_id -> kernel_info, LRU order
+        self._shutdown_listeners: List[Callable[[str, Dict], None]] = []
+        self._client = httpx.AsyncClient(timeout=10)
+        self._creation_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._starting = 0
         
-        # Create a new kernel in the shared Jupyter Gateway
+        # One (deadline, conv_id, kernel_id) entry per kernel; touching a kernel only
+        # updates last_used and the reaper re-queues entries that turn out to be stale
+        self._expiry: List[Tuple[float, str, str]] = []
+        self._expiry_changed = asyncio.Event()
+        self._reaper_task: Optional[asyncio.Task] = None
+        self._delete_slots = asyncio.Semaphore(settings.KERNEL_DELETE_CONCURRENCY)
+        self._deletes: Set[asyncio.Task] = set()
+        
+        # Pool of started, unassigned kernels
+        self._pool: List[Dict] = []
+        self._pool_wanted = asyncio.Event()
+        self._pool_task: Optional[asyncio.Task] = None
+        self._warmup: Optional[Callable[[Dict], Awaitable[None]]] = None
+        self._snapshot: Optional[Snapshotter] = None
+        self._restore: Optional[Restorer] = None
+        self._hibernating: Dict[str, asyncio.Task] = {}
+        self._snapshots: Dict[str, str] = {}  # conv_id -> gateway holding its hibernated state, without a registry
+        self.pool_hits = 0
+        self.pool_misses = 0
+        
+        self._create_seconds = KERNEL_CREATE_SECONDS.labels()
+        self._pool_hit = KERNEL_POOL_ACQUIRED.labels("hit")
+        self._pool_miss = KERNEL_POOL_ACQUIRED.labels("miss")
+        self._removed = {reason: KERNELS_REMOVED.labels(reason) for reason in ("idle", "evicted", "closed", "failed")}
+        self._snapshot_seconds = KERNEL_SNAPSHOT_SECONDS.labels()
+        self._interrupted = KERNEL_INTERRUPTS.labels()
+        KERNELS_ACTIVE.set_function(self.get_session_count)
+        KERNEL_POOL_IDLE.set_function(lambda: len(self._pool))
+        for gateway in self._gateways.values():
+            GATEWAY_UP.labels(gateway.url).set_function(lambda g=gateway: int(g.healthy))
+            GATEWAY_KERNELS.labels(gateway.url).set_function(lambda g=gateway: g.kernels)
+    
+    def add_shutdown_listener(self, listener: Callable[[str, Dict], None]):
+        """Register a callback invoked with (conv_id, kernel_info) when a kernel is removed"""
+        self._shutdown_listeners.append(listener)
+    
+    def set_warmup(self, warmup: Callable[[Dict], Awaitable[None]]):
+        """Set the coroutine run on every pooled kernel before it is handed out"""
+        self._warmup = warmup
+    
+    def set_hibernation(self, snapshot: Snapshotter, restore: Restorer):
+        """Set the coroutines that save a kernel's state before an idle shutdown and load it back"""
+        self._snapshot = snapshot
+        self._restore = restore
+    
+    async def start(self):
+        """Start the idle kernel reaper and gateway health checks and fill the kernel pool"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_expired())
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_gateways())
+        if settings.KERNEL_POOL_HIGH > 0 and self._pool_task is None:
+            self._pool_task = asyncio.create_task(self._refill_pool())
+            self._pool_wanted.set()
+    
+    async def stop(self):
+        """Stop background tasks, release pooled kernels and finish pending deletes"""
+        for task in (self._reaper_task, self._pool_task, self._health_task):
+            if task is not None:
+                task.cancel()
+        self._reaper_task = self._pool_task = self._health_task = None
+        pooled, self._pool = self._pool, []
+        for kernel_info in pooled:
+            self._spawn_delete(kernel_info)
+        if self._deletes:
+            await asyncio.gather(*self._deletes, return_exceptions=True)
+        await self._client.aclose()
+        if self._registry is not None:
+            self._registry.close()
+    
+    def _live(self) -> int:
+        """Kernels that exist or are being started: assigned, pooled, starting and hibernating"""
+        return len(self._kernels) + len(self._pool) + self._starting + len(self._hibernating)
+    
+    def _has_room(self) -> bool:
+        return self.max_live <= 0 or self._live() < self.max_live
+    
+    def _pick_gateway(self, preferred: Optional[str] = None, exclude: Set[str] = frozenset()) -> Gateway:
+        """The preferred gateway if healthy, else the healthy one with the fewest kernels"""
+        gateway = self._gateways.get(preferred)
+        if gateway is not None and gateway.healthy and gateway.url not in exclude:
+            return gateway
+        candidates = [g for g in self._gateways.values() if g.url not in exclude]
+        # With every gateway down, still try them rather than fail without asking
+        return min([g for g in candidates if g.healthy] or candidates, key=lambda g: g.kernels)
+    
+    async def _create_kernel(self, preferred: Optional[str] = None) -> Dict:
+        """Start a new kernel, moving on to the next gateway if one is unreachable"""
+        tried: Set[str] = set()
+        while True:
+            gateway = self._pick_gateway(preferred, tried)
+            started = time.perf_counter()
+            try:
+                r = await self._client.post(
+                    f"{gateway.url}/api/kernels",
+                    params={"token": settings.JUPY_TOKEN},
+                    json={"name": "python3"}
+                )
+            except httpx.TransportError:
+                self._check_failed(gateway)
+                tried.add(gateway.url)
+                if len(tried) == len(self._gateways):
+                    raise
+                continue
+            r.raise_for_status()
+            kid = r.json()["id"]
+            self._create_seconds.observe(time.perf_counter() - started)
+            gateway.kernels += 1
+            return self._kernel_info(gateway.url, kid)
+    
+    def _kernel_info(self, base_url: str, kid: str) -> Dict:
+        # Generate a consistent session ID for this kernel
+        session_id = uuid.uuid4().hex
+        
+        ws_url = f"{base_url.replace('http','ws')}/api/kernels/{kid}/channels?token={settings.JUPY_TOKEN}&session={session_id}"
+        
+        return {
+            "kernel_id": kid, 
+            "ws_url": ws_url, 
+            "base_url": base_url,
+            "session_id": session_id,
+            "last_used": time.time()
+        }
+    
+    async def _kernel_alive(self, kernel_info: Dict) -> bool:
+        """Whether the gateway still has the kernel; unknown counts as alive"""
+        gateway = self._gateways.get(kernel_info["base_url"])
+        if gateway is not None and not gateway.healthy:
+            return False
         try:
-            r = requests.post(
-                urljoin(self.gateway_url, f"/api/kernels?token={settings.JUPY_TOKEN}"), 
-                json={"name": "python3"}, 
-                timeout=10
+            r = await self._client.get(
+                f"{kernel_info['base_url']}/api/kernels/{kernel_info['kernel_id']}",
+                params={"token": settings.JUPY_TOKEN}
             )
+        except Exception:
+            return True
+        return r.status_code != 404
+    
+    async def _delete_kernel(self, kernel_info: Dict):
+        """Delete a kernel from the Jupyter Gateway, ignoring failures"""
+        try:
+            r = await self._client.delete(
+                f"{kernel_info['base_url']}/api/kernels/{kernel_info['kernel_id']}",
+                params={"token": settings.JUPY_TOKEN},
+                timeout=5
+            )
+        except Exception:
+            return
+        gateway = self._gateways.get(kernel_info["base_url"])
+        if gateway is not None and r.is_success:
+            gateway.kernels = max(gateway.kernels - 1, 0)
+    
+    async def interrupt_kernel(self, kernel_info: Dict):
+        """Interrupt whatever the kernel is running"""
+        self._interrupted.inc()
+        try:
+            await self._client.post(
+                f"{kernel_info['base_url']}/api/kernels/{kernel_info['kernel_id']}/interrupt",
+                params={"token": settings.JUPY_TOKEN},
+                timeout=5
+            )
+        except Exception:
+            pass
+    
+    async def _check_gateways(self):
+        """Poll every gateway's kernel list for health and load"""
+        while True:
+            await asyncio.gather(*(self._check_gateway(g) for g in self._gateways.values()))
+            await asyncio.sleep(settings.JUPYTER_GATEWAY_HEALTH_INTERVAL)
+    
+    async def _check_gateway(self, gateway: Gateway):
+        try:
+            r = await self._client.get(f"{gateway.url}/api/kernels", params={"token": settings.JUPY_TOKEN}, timeout=5)
             r.raise_for_status()
-            kernel_data = r.json()
-            kid = kernel_data["id"]
+            kernels = len(r.json())
+        except Exception:
+            self._check_failed(gateway)
+            return
+        gateway.kernels = kernels
+        gateway.failures = 0
+        if not gateway.healthy:
+            gateway.healthy = True
+            orphans, gateway.orphans = gateway.orphans, []
+            for kernel_info in orphans:
+                self._spawn_delete(kernel_info)
+            if self._pool_task is not None:
+                self._pool_wanted.set()
+    
+    def _check_failed(self, gateway: Gateway):
+        gateway.failures += 1
+        if gateway.healthy and gateway.failures >= settings.JUPYTER_GATEWAY_MAX_FAILURES:
+            self._fail_over(gateway)
+    
+    def _fail_over(self, gateway: Gateway):
+        """Take a gateway out of placement and drop its kernels so their conversations start over elsewhere.
+        
+        The dropped kernels are deleted if the gateway comes back, in case it
+        was only unreachable for a while.
+        """
+        gateway.healthy = False
+        gateway.orphans += [k for k in self._pool if k["base_url"] == gateway.url]
+        self._pool = [k for k in self._pool if k["base_url"] != gateway.url]
+        for conv_id in [c for c, k in self._kernels.items() if k["base_url"] == gateway.url]:
+            kernel_info = self._kernels[conv_id]
+            if self._registry is not None:
+                self._registry.remove(conv_id, kernel_info["kernel_id"])
+            self._forget(conv_id)
+            gateway.orphans.append(kernel_info)
+            self._removed["failed"].inc()
+        if self._pool_task is not None:
+            self._pool_wanted.set()
+    
+    def _spawn_delete(self, kernel_info: Dict) -> asyncio.Task:
+        """Delete a kernel in the background, a bounded number at a time"""
+        async def delete():
+            async with self._delete_slots:
+                await self._delete_kernel(kernel_info)
+        
+        task = asyncio.create_task(delete())
+        self._deletes.add(task)
+        task.add_done_callback(self._deletes.discard)
+        return task
+    
+    def _retire(self, conv_id: str, reason: str) -> Optional[asyncio.Task]:
+        """Detach a conversation's kernel and shut it down in the background.
+        
+        Idle and evicted kernels are hibernated first when hooks are set; the
+        returned task finishes once the kernel is gone. A kernel another worker
+        still uses is only forgotten here.
+        """
+        if reason == "closed":
+            self._snapshots.pop(conv_id, None)
+        kernel_info = self._kernels.get(conv_id)
+        if kernel_info is None:
+            return None
+        hibernate = reason != "closed" and self._snapshot is not None
+        if self._registry is not None:
+            if reason == "closed":
+                self._registry.remove(conv_id, kernel_info["kernel_id"])
+            else:
+                idle_before = kernel_info["last_used"] if reason == "evicted" else time.time() - self.ttl
+                lease = settings.KERNEL_CLAIM_TIMEOUT if hibernate else 0
+                if not self._registry.release(conv_id, kernel_info["kernel_id"], idle_before, lease):
+                    self._forget(conv_id)
+                    return None
+        del self._kernels[conv_id]
+        self._removed[reason].inc()
+        if hibernate:
+            task = asyncio.create_task(self._hibernate(conv_id, kernel_info))
+            self._hibernating[conv_id] = task
+            return task
+        return self._shut_down(conv_id, kernel_info)
+    
+    def _shut_down(self, conv_id: str, kernel_info: Dict) -> asyncio.Task:
+        """Notify listeners and delete the kernel"""
+        for listener in self._shutdown_listeners:
+            listener(conv_id, kernel_info)
+        if self._pool_task is not None and len(self._pool) < settings.KERNEL_POOL_LOW:
+            self._pool_wanted.set()
+        return self._spawn_delete(kernel_info)
+    
+    def _forget(self, conv_id: str):
+        """Drop a kernel another worker owns now from this worker without deleting it"""
+        kernel_info = self._kernels.pop(conv_id)
+        for listener in self._shutdown_listeners:
+            listener(conv_id, kernel_info)
+    
+    async def _hibernate(self, conv_id: str, kernel_info: Dict):
+        """Snapshot the kernel's namespace, then shut it down.
+        
+        The gateway holding the snapshot is recorded, in the registry if there
+        is one, so the conversation's next kernel is placed there.
+        """
+        started = time.perf_counter()
+        snapshot = None
+        try:
+            await asyncio.wait_for(self._snapshot(conv_id, kernel_info), settings.KERNEL_HIBERNATE_TIMEOUT)
+            self._snapshot_seconds.observe(time.perf_counter() - started)
+            snapshot = kernel_info["base_url"]
+            if self._registry is None:
+                self._snapshots[conv_id] = snapshot
+        except Exception:
+            pass  # the kernel goes either way; the conversation just starts fresh
+        finally:
+            del self._hibernating[conv_id]
+            await self._shut_down(conv_id, kernel_info)
+            if self._registry is not None:
+                await asyncio.to_thread(self._registry.abandon, conv_id, snapshot)
+    
+    def _schedule_expiry(self, conv_id: str, kernel_info: Dict, deadline: float):
+        heapq.heappush(self._expiry, (deadline, conv_id, kernel_info["kernel_id"]))
+        if self._expiry[0][2] == kernel_info["kernel_id"]:
+            # New earliest deadline: wake the reaper so it sleeps for the right time
+            self._expiry_changed.set()
+    
+    def _reap(self, now: float):
+        """Retire every kernel whose idle deadline has passed"""
+        while self._expiry and self._expiry[0][0] <= now:
+            _, conv_id, kernel_id = heapq.heappop(self._expiry)
+            kernel_info = self._kernels.get(conv_id)
+            if kernel_info is None or kernel_info["kernel_id"] != kernel_id:
+                continue  # already removed
+            if kernel_info["busy"]:
+                self._schedule_expiry(conv_id, kernel_info, now + self.ttl)
+            elif kernel_info["last_used"] + self.ttl > now:
+                self._schedule_expiry(conv_id, kernel_info, kernel_info["last_used"] + self.ttl)
+            else:
+                self._retire(conv_id, "idle")
+    
+    async def _reap_expired(self):
+        """Sleep until the earliest kernel deadline, then reap"""
+        while True:
+            timeout = max(self._expiry[0][0] - time.time(), 0) if self._expiry else None
+            self._expiry_changed.clear()
+            try:
+                await asyncio.wait_for(self._expiry_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._reap(time.time())
+    
+    async def _make_room(self):
+        """Evict least recently used idle kernels until another one may be started"""
+        while not self._has_room():
+            victim = next((c for c, k in self._kernels.items() if not k["busy"]), None)
+            if victim is None:
+                if self._hibernating:
+                    # Room is on its way once a hibernating kernel is gone
+                    await asyncio.wait(list(self._hibernating.values()))
+                    continue
+                raise KernelCapacityError(f"All {self.max_live} kernels are busy, try again later")
+            task = self._retire(victim, "evicted")
+            if victim in self._hibernating:
+                # Still live until its snapshot is written
+                await asyncio.shield(task)
+    
+    async def _refill_pool(self):
+        """Top the pool up to the high watermark whenever it drops below the low one"""
+        while True:
+            await self._pool_wanted.wait()
+            self._pool_wanted.clear()
+            while len(self._pool) < settings.KERNEL_POOL_HIGH and self._has_room():
+                self._starting += 1
+                try:
+                    kernel_info = await self._create_kernel()
+                    if self._warmup is not None:
+                        try:
+                            await self._warmup(kernel_info)
+                        except Exception:
+                            pass
+                except Exception:
+                    # Gateway not reachable yet; try again later
+                    await asyncio.sleep(settings.KERNEL_POOL_RETRY_DELAY)
+                    continue
+                finally:
+                    self._starting -= 1
+                self._pool.append(kernel_info)
+    
+    def _acquire_pooled(self, preferred: Optional[str] = None) -> Optional[Dict]:
+        """Take a kernel from the pool, on the preferred gateway if it is up, and schedule a refill if it runs low"""
+        gateway = self._gateways.get(preferred)
+        if gateway is not None and gateway.healthy:
+            index = next((i for i, k in enumerate(self._pool) if k["base_url"] == preferred), None)
+        else:
+            index = 0 if self._pool else None
+        kernel_info = self._pool.pop(index) if index is not None else None
+        if kernel_info is not None:
+            self.pool_hits += 1
+            self._pool_hit.inc()
+        else:
+            self.pool_misses += 1
+            self._pool_miss.inc()
+        if self._pool_task is not None and len(self._pool) < settings.KERNEL_POOL_LOW:
+            self._pool_wanted.set()
+        return kernel_info
+    
+    def _creation_lock(self, conv_id: str) -> asyncio.Lock:
+        lock = self._creation_locks.get(conv_id)
+        if lock is None:
+            lock = self._creation_locks[conv_id] = asyncio.Lock()
+        return lock
+    
+    def _touch(self, conv_id: str, kernel_info: Dict):
+        kernel_info["last_used"] = time.time()
+        self._kernels.move_to_end(conv_id)
+    
+    async def _start_for(self, conv_id: str, preferred: Optional[str] = None) -> Dict:
+        """Start a kernel for a conversation, deleting it if the caller is cancelled meanwhile"""
+        await self._make_room()
+        # Counted as live from here until the caller registers it, which happens
+        # without yielding to the loop once this returns
+        self._starting += 1
+        task = asyncio.ensure_future(self._create_kernel(preferred))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(self._discard_started)
+            raise
+        finally:
+            self._starting -= 1
+    
+    def _discard_started(self, task: asyncio.Task):
+        """Delete a kernel whose requester went away while it was starting"""
+        if not task.cancelled() and task.exception() is None:
+            self._spawn_delete(task.result())
+    
+    async def _claim(self, conv_id: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """Adopt the live kernel of another worker, or claim the conversation for this one.
+        
+        Returns (kernel_info, None) when adopting, else (None, the gateway
+        holding the conversation's snapshot or None) once this worker may start a kernel.
+        """
+        while True:
+            state, mapped = await asyncio.to_thread(self._registry.claim, conv_id, settings.KERNEL_CLAIM_TIMEOUT)
+            if state == CLAIMED:
+                return None, mapped["snapshot"] if mapped is not None else None
+            if state == ADOPT:
+                kernel_info = self._kernel_info(mapped["base_url"], mapped["kernel_id"])
+                if await self._kernel_alive(kernel_info):
+                    return kernel_info, None
+                await asyncio.to_thread(self._registry.remove, conv_id, mapped["kernel_id"])
+                continue
+            # Another worker is starting or hibernating it
+            await asyncio.sleep(0.1)
+    
+    async def _claim_or_start(self, conv_id: str) -> Dict:
+        """Adopt another worker's live kernel, or claim the conversation and start one.
+        
+        On failure or cancellation the claim is given up and a kernel started
+        for it deleted, even if it was published already.
+        """
+        while True:
+            kernel_info = None
+            try:
+                adopted, snapshot = await self._claim(conv_id)
+                if adopted is not None:
+                    return adopted
+                kernel_info = await self._new_kernel(conv_id, snapshot)
+                if await asyncio.to_thread(self._registry.publish, conv_id, kernel_info["kernel_id"],
+                                           kernel_info["base_url"]):
+                    return kernel_info
+            except BaseException:
+                if kernel_info is not None:
+                    self._spawn_delete(kernel_info)
+                    await asyncio.to_thread(self._registry.remove, conv_id, kernel_info["kernel_id"])
+                await asyncio.to_thread(self._registry.abandon, conv_id)
+                raise
+            # The lease ran out while the kernel started and another worker claimed the conversation
+            self._spawn_delete(kernel_info)
+    
+    async def _new_kernel(self, conv_id: str, snapshot: Optional[str] = None) -> Dict:
+        """Start or take a pooled kernel and restore the conversation's hibernated state into it.
+        
+        snapshot is the gateway whose disk holds the conversation's snapshot;
+        the kernel is placed there if it is up. Without one there is nothing to
+        restore and the restore hook is skipped.
+        """
+        try:
+            kernel_info = self._acquire_pooled(snapshot) or await self._start_for(conv_id, snapshot)
+        except KernelCapacityError:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to create kernel for conversation {conv_id}: {e}")
+        
+        if self._restore is not None and snapshot is not None:
+            try:
+                await asyncio.wait_for(self._restore(conv_id, kernel_info), settings.KERNEL_HIBERNATE_TIMEOUT)
+            except asyncio.CancelledError:
+                self._shut_down(conv_id, kernel_info)
+                raise
+            except Exception:
+                pass
+        return kernel_info
+    
+    async def ensure_kernel(self, conv_id: str) -> Dict:
+        """Ensure a kernel exists for the conversation.
+        
+        With a registry, a kernel this worker knows is returned without asking
+        whether another worker has retired it since; use_kernel finds out when
+        its touch fails.
+        """
+        kernel_info = self._kernels.get(conv_id)
+        if kernel_info:
+            self._touch(conv_id, kernel_info)
+            return kernel_info
+        
+        # Concurrent first calls for one conversation share a single kernel
+        async with self._creation_lock(conv_id):
+            kernel_info = self._kernels.get(conv_id)
+            if kernel_info:
+                self._touch(conv_id, kernel_info)
+                return kernel_info
             
-            # Generate a consistent session ID for this conversation
-            import uuid
-            session_id = uuid.uuid4().hex
+            hibernating = self._hibernating.get(conv_id)
+            if hibernating is not None:
+                # Let the snapshot finish so the new kernel restores the latest state
+                await asyncio.shield(hibernating)
             
-            ws_url = f"{self.gateway_url.replace('http','ws')}/api/kernels/{kid}/channels?token={settings.JUPY_TOKEN}&session={session_id}"
+            if self._registry is None:
+                kernel_info = await self._new_kernel(conv_id, self._snapshots.get(conv_id))
+                self._snapshots.pop(conv_id, None)
+            else:
+                kernel_info = await self._claim_or_start(conv_id)
             
-            kernel_info = {
-                "kernel_id": kid, 
-                "ws_url": ws_url, 
-                "base_url": self.gateway_url,
-                "session_id": session_id,
-                "last_used": time.time()
-            }
+            kernel_info["busy"] = 0
             self._kernels[conv_id] = kernel_info
+            self._touch(conv_id, kernel_info)
+            self._schedule_expiry(conv_id, kernel_info, kernel_info["last_used"] + self.ttl)
             return kernel_info
-            
-        except Exception as e:
-            raise Exception(f"Failed to create kernel for conversation {conv_id}: {e}")
     
-    def cleanup_session(self, conv_id: str):
-        """Clean up a specific kernel"""
-        if conv_id in self._kernels:
-            kernel_info = self._kernels[conv_id]
+    @asynccontextmanager
+    async def use_kernel(self, conv_id: str) -> AsyncIterator[Dict]:
+        """Ensure the conversation's kernel and keep it from being reaped or evicted while in use"""
+        kernel_info = await self.ensure_kernel(conv_id)
+        while True:
+            # Busy before the registry is asked, so the reaper leaves it alone meanwhile
+            kernel_info["busy"] += 1
             try:
-                # Delete the kernel from Jupyter Gateway
-                requests.delete(
-                    urljoin(self.gateway_url, f"/api/kernels/{kernel_info['kernel_id']}?token={settings.JUPY_TOKEN}"),
-                    timeout=5
-                )
-            except Exception:
-                pass
-            del self._kernels[conv_id]
+                if self._registry is None or await asyncio.to_thread(
+                        self._registry.touch, conv_id, kernel_info["kernel_id"], 1):
+                    break
+            except BaseException:
+                kernel_info["busy"] -= 1
+                raise
+            # Retired or replaced by another worker
+            kernel_info["busy"] -= 1
+            if self._kernels.get(conv_id) is kernel_info:
+                self._forget(conv_id)
+            kernel_info = await self.ensure_kernel(conv_id)
+        try:
+            yield kernel_info
+        finally:
+            kernel_info["busy"] -= 1
+            kernel_info["last_used"] = time.time()
+            if self._registry is not None:
+                await asyncio.to_thread(self._registry.touch, conv_id, kernel_info["kernel_id"], -1)
     
-    def gc_idle(self, ttl: int = None):
-        """Garbage collect idle kernels"""
-        if ttl is None:
-            ttl = settings.JUPYTER_SESSION_TTL
-            
-        now = time.time()
-        dead = [k for k, v in self._kernels.items() if now - v["last_used"] > ttl]
-        
-        for conv_id in dead:
-            self.cleanup_session(conv_id)
+    async def cleanup_session(self, conv_id: str):
+        """Clean up a specific kernel"""
+        task = self._retire(conv_id, "closed")
+        if task is None and self._registry is not None:
+            # Started by another worker
+            mapped = await asyncio.to_thread(self._registry.lookup, conv_id)
+            if mapped is not None:
+                await asyncio.to_thread(self._registry.remove, conv_id, mapped["kernel_id"])
+                task = self._spawn_delete(mapped)
+        if task is not None:
+            await task
     
     def get_session_count(self) -> int:
         """Get number of active kernels"""
-        return len(self._kernels)
\ No newline at end of file
+        return len(self._kernels)
+    
+    def get_pool_stats(self) -> Dict[str, int]:
+        """Get kernel pool size and hit/miss counters"""
+        return {"idle": len(self._pool), "hits": self.pool_hits, "misses": self.pool_misses}
+    
+    def get_gateway_stats(self) -> List[Dict]:
+        """Get health and kernel count of every gateway"""
+        return [gateway.get_stats() for gateway in self._gateways.values()]
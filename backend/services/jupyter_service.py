@@ -1,84 +1,163 @@
+import asyncio
 import json
-import time
-import uuid
-from websocket import create_connection
+from contextlib import aclosing
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+from ..core.config import settings
+from .artifact_store import ArtifactStore
 from .jupyter_gateway_service import JupyterGatewayService
+from .kernel_channel import KernelChannel
+from .output_capture import SPILL_BATCH_CHARS, OutputCapture, OutputStore
+from .kernel_snapshot import parse_report, restore_code, restore_note, snapshot_code, snapshot_path
+
+# Receives (kind, text) for every output chunk of a running cell; an "artifact"
+# chunk is the JSON reference of a stored rich output
+OutputCallback = Callable[[str, str], None]
 
 class JupyterService:
-    def __init__(self, jupyter_gateway_service: JupyterGatewayService):
+    def __init__(self, jupyter_gateway_service: JupyterGatewayService, artifact_store: ArtifactStore):
         self.jupyter_gateway_service = jupyter_gateway_service
+        self.artifact_store = artifact_store
+        self._channels: Dict[str, KernelChannel] = {}
+        self.output_store = OutputStore(settings.TOOL_OUTPUT_DIR, settings.TOOL_OUTPUT_SPILL_MAX_CHARS)
+        self.jupyter_gateway_service.add_shutdown_listener(self._on_kernel_shutdown)
+        self.jupyter_gateway_service.set_warmup(self._warm_kernel)
+        if settings.KERNEL_HIBERNATE:
+            self.jupyter_gateway_service.set_hibernation(self._snapshot_kernel, self._restore_kernel)
     
-    def _jupyter_execute(self, ws_url: str, session_id: str, code: str, timeout: int = 120) -> str:
-        """Execute code in Jupyter kernel via fresh websocket connection"""
-        msg_id = uuid.uuid4().hex
-        content = {
-            "code": code, 
-            "silent": False, 
-            "store_history": True, 
-            "allow_stdin": False, 
-            "stop_on_error": True
-        }
-        header = {
-            "msg_id": msg_id, 
-            "username": "user", 
-            "session": session_id, 
-            "date": "", 
-            "msg_type": "execute_request", 
-            "version": "5.3"
-        }
-        msg = {
-            "header": header, 
-            "parent_header": {}, 
-            "metadata": {}, 
-            "content": content
-        }
-        
-        ws = create_connection(ws_url, timeout=30)
+    def _get_channel(self, kernel_info: Dict) -> KernelChannel:
+        """Get the persistent channel for a kernel, opening a new one if needed"""
+        kid = kernel_info["kernel_id"]
+        channel = self._channels.get(kid)
+        if channel is None or channel.closed:
+            channel = KernelChannel(kernel_info["ws_url"], kernel_info["session_id"])
+            self._channels[kid] = channel
+        return channel
+    
+    def _on_kernel_shutdown(self, conv_id: str, kernel_info: Dict):
+        """Drop the channel of a kernel the gateway service has shut down"""
+        channel = self._channels.pop(kernel_info["kernel_id"], None)
+        if channel is not None:
+            channel.close()
+    
+    async def _warm_kernel(self, kernel_info: Dict):
+        """Connect a pooled kernel's channel and run the configured pre-imports"""
+        channel = self._get_channel(kernel_info)
+        await self._jupyter_execute(channel, settings.KERNEL_POOL_PREIMPORT or "pass", timeout=60)
+    
+    async def _snapshot_kernel(self, conv_id: str, kernel_info: Dict):
+        """Pickle the kernel's user namespace to its snapshot file"""
+        code = snapshot_code(snapshot_path(settings.KERNEL_HIBERNATE_DIR, conv_id), settings.KERNEL_HIBERNATE_MAX_BYTES)
+        output = await self._jupyter_execute(self._get_channel(kernel_info), code, timeout=settings.KERNEL_HIBERNATE_TIMEOUT)
+        if parse_report(output) is None:
+            raise RuntimeError(f"Kernel snapshot failed: {output[-500:]}")
+    
+    async def _restore_kernel(self, conv_id: str, kernel_info: Dict):
+        """Load the conversation's snapshot, if any, into a fresh kernel"""
+        code = restore_code(snapshot_path(settings.KERNEL_HIBERNATE_DIR, conv_id))
+        output = await self._jupyter_execute(self._get_channel(kernel_info), code, timeout=settings.KERNEL_HIBERNATE_TIMEOUT)
+        report = parse_report(output)
+        if report and (report["restored"] or report["lost"]):
+            # Reported with the output of the first execution in the new kernel
+            kernel_info["restore_note"] = restore_note(report)
+    
+    async def _iter_execute(self, channel: KernelChannel, code: str, timeout: int = 120,
+                            kernel_info: Optional[Dict] = None) -> AsyncIterator[Tuple[str, str]]:
+        """Execute code and yield (kind, text) chunks as the kernel produces them.
         
+        kind is one of "stdout", "stderr", "result", "artifact", "error", or "idle"
+        once the kernel has finished the request. Rich outputs (plots, HTML) go to
+        the artifact store and are yielded as the JSON of their reference.
+        With kernel_info, a cell that is given up on (timeout, cancellation,
+        caller stops reading) is interrupted once the kernel has started it;
+        one still queued behind others is just dropped.
+        """
+        interrupt = None
+        if kernel_info is not None:
+            interrupt = partial(self.jupyter_gateway_service.interrupt_kernel, kernel_info)
         try:
-            # Send our execution request
-            ws.send(json.dumps(msg))
-            
-            stdout, stderr = [], []
-            result = None
-            idle = False
-            t0 = time.time()
-            
-            while time.time() - t0 < timeout:
-                try:
-                    raw = ws.recv()
-                    m = json.loads(raw)
+            async with aclosing(channel.execute(code, timeout, interrupt)) as messages:
+                async for m in messages:
                     mtype = m.get("msg_type") or m.get("msg", "")
                     c = m.get("content", {})
                     
-                    # Only process messages for our request
-                    if m.get("parent_header", {}).get("msg_id") == msg_id:
-                        if mtype in ("stream",):
-                            (stdout if c.get("name") == "stdout" else stderr).append(c.get("text", ""))
-                        elif mtype == "execute_result":
-                            data = c.get("data", {})
-                            if "text/plain" in data:
-                                result = data["text/plain"]
-                        elif mtype == "error":
-                            stderr.append("\n".join(c.get("traceback", [])))
-                        elif mtype == "status" and c.get("execution_state") == "idle":
-                            # This idle status is for our request - we're done
-                            idle = True
-                            break
-                except Exception as e:
-                    break
-            
+                    if mtype in ("stream",):
+                        yield ("stdout" if c.get("name") == "stdout" else "stderr"), c.get("text", "")
+                    elif mtype in ("execute_result", "display_data"):
+                        data = c.get("data", {})
+                        ref = await asyncio.to_thread(self.artifact_store.put_bundle, data)
+                        if ref is not None:
+                            yield "artifact", json.dumps(ref)
+                        # A displayed figure's text is only its repr, e.g. "<Figure size 640x480 with 1 Axes>"
+                        if "text/plain" in data and (mtype == "execute_result" or ref is None):
+                            yield "result", data["text/plain"]
+                    elif mtype == "error":
+                        yield "error", "\n".join(c.get("traceback", []))
+                    elif mtype == "status" and c.get("execution_state") == "idle":
+                        yield "idle", ""
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+    
+    async def _jupyter_execute(self, channel: KernelChannel, code: str, timeout: int = 120,
+                               on_output: Optional[OutputCallback] = None, kernel_info: Optional[Dict] = None,
+                               conv_id: Optional[str] = None) -> str:
+        """Execute code in Jupyter kernel over its persistent channel.
+        
+        Each stream keeps only its head and tail in memory; with conv_id, output
+        too long for that is saved in full under a handle the model can page through.
+        """
+        stdout, stderr, result = (
+            OutputCapture(settings.TOOL_OUTPUT_HEAD_CHARS, settings.TOOL_OUTPUT_TAIL_CHARS,
+                          self.output_store if conv_id is not None else None, conv_id)
+            for _ in range(3)
+        )
+        artifacts = []
+        idle = False
+        
+        try:
+            async with aclosing(self._iter_execute(channel, code, timeout, kernel_info)) as chunks:
+                async for kind, text in chunks:
+                    if kind == "idle":
+                        idle = True
+                        continue
+                    if kind == "artifact":
+                        ref = json.loads(text)
+                        artifacts.append(f"\n[{ref['mime']} output ({ref['size']} bytes): {ref['url']}]")
+                    else:
+                        capture = stdout if kind == "stdout" else result if kind == "result" else stderr
+                        capture.write(text)
+                        if capture.pending_chars >= SPILL_BATCH_CHARS:
+                            await capture.flush()
+                    if on_output is not None:
+                        on_output(kind, text)
         finally:
-            ws.close()
+            for capture in (stdout, stderr, result):
+                await capture.close()
         
-        if not idle and not result and not stdout and not stderr:
+        if not idle and not result.total and not stdout.total and not stderr.total and not artifacts:
             return "[python error] timeout"
-        if stderr:
-            return "[python error]\n" + "".join(stderr)
-        return (result or "") + "".join(stdout)
+        if stderr.total:
+            # Output printed before the error still counts, as do the handles of what was spilled
+            return "[python error]\n" + result.text() + stdout.text() + stderr.text() + "".join(artifacts)
+        return result.text() + stdout.text() + "".join(artifacts)
     
-    def execute_python(self, conv_id: str, code: str) -> str:
+    async def prepare_kernel(self, conv_id: str):
+        """Get the conversation's kernel and channel ready ahead of an execution.
+        
+        execute_python then finds both in place, or joins the preparation still
+        running through the gateway's per-conversation creation lock.
+        """
+        kernel_info = await self.jupyter_gateway_service.ensure_kernel(conv_id)
+        await self._get_channel(kernel_info).connect()
+    
+    async def execute_python(self, conv_id: str, code: str, on_output: Optional[OutputCallback] = None) -> str:
         """Execute Python code for a conversation"""
-        kernel_info = self.jupyter_gateway_service.ensure_kernel(conv_id)
-        kernel_info["last_used"] = time.time()
-        return self._jupyter_execute(kernel_info["ws_url"], kernel_info["session_id"], code)
\ No newline at end of file
+        async with self.jupyter_gateway_service.use_kernel(conv_id) as kernel_info:
+            note = kernel_info.pop("restore_note", "")
+            result = await self._jupyter_execute(self._get_channel(kernel_info), code, on_output=on_output,
+                                                 kernel_info=kernel_info, conv_id=conv_id)
+            return note + result
+    
+    def forget(self, conv_id: str):
+        """Delete the saved outputs of a deleted conversation"""
+        self.output_store.delete(conv_id)
\ No newline at end of file
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+from typing import Awaitable, Callable, Dict, Any, AsyncIterator, Optional
+from websockets.asyncio.client import connect, ClientConnection
+from websockets.exceptions import ConnectionClosed
+from ..core.config import settings
+
+def _is_idle(m: Dict[str, Any]) -> bool:
+    """Whether a message is the kernel's idle status ending its request"""
+    mtype = m.get("msg_type") or m.get("header", {}).get("msg_type")
+    return mtype == "status" and m.get("content", {}).get("execution_state") == "idle"
+
+class KernelChannel:
+    """Long-lived websocket channel to one Jupyter kernel, shared by all executions.
+    
+    A single supervisor task owns the connection: it (re)connects with backoff,
+    keeps it alive with websocket pings and routes every incoming message to the
+    queue of the request whose msg_id matches ``parent_header.msg_id``.
+    Executions run one at a time in FIFO order, as the kernel would run them.
+    """
+    
+    def __init__(self, ws_url: str, session_id: str):
+        self.ws_url = ws_url
+        self.session_id = session_id
+        self._ws: Optional[ClientConnection] = None
+        self._pending: Dict[str, asyncio.Queue] = {}
+        self._executing = asyncio.Lock()  # fair, so waiting executions keep their order
+        self._ready = asyncio.Event()
+        self._supervisor: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closed = False
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed
+    
+    def _start(self):
+        if self._supervisor is None:
+            self._loop = asyncio.get_running_loop()
+            self._supervisor = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        """Connect, read and route messages; reconnect until closed or out of retries"""
+        attempt = 0
+        try:
+            while not self._closed:
+                try:
+                    ws = await connect(
+                        self.ws_url,
+                        open_timeout=30,
+                        ping_interval=settings.JUPYTER_WS_PING_INTERVAL,
+                        ping_timeout=settings.JUPYTER_WS_PING_TIMEOUT,
+                        max_size=None,
+                    )
+                except Exception:
+                    attempt += 1
+                    if attempt > settings.JUPYTER_WS_MAX_RETRIES:
+                        break
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+                    continue
+                
+                attempt = 0
+                self._ws = ws
+                self._ready.set()
+                try:
+                    async for raw in ws:
+                        self._route(raw)
+                except ConnectionClosed:
+                    pass
+                finally:
+                    self._ready.clear()
+                    self._ws = None
+                    await ws.close()
+        finally:
+            # Wake up every waiter: nothing more will arrive on this channel
+            self._closed = True
+            self._ready.set()
+            for queue in self._pending.values():
+                queue.put_nowait(None)
+    
+    def _route(self, raw):
+        try:
+            m = json.loads(raw)
+        except ValueError:
+            return
+        queue = self._pending.get(m.get("parent_header", {}).get("msg_id"))
+        if queue is not None:
+            queue.put_nowait(m)
+    
+    async def connect(self, timeout: float = 30):
+        """Open the connection ahead of the first execution"""
+        self._start()
+        await asyncio.wait_for(self._ready.wait(), timeout)
+    
+    async def _send(self, msg: Dict[str, Any], timeout: float):
+        """Send a message, waiting for (re)connection if necessary"""
+        self._start()
+        deadline = time.time() + timeout
+        failed = None
+        while True:
+            await asyncio.wait_for(self._ready.wait(), max(deadline - time.time(), 0))
+            ws = self._ws
+            if self._closed or ws is None:
+                raise ConnectionError(f"Kernel channel closed: {self.ws_url}")
+            if ws is failed:
+                # The supervisor has not noticed the drop yet
+                if time.time() >= deadline:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                await ws.send(json.dumps(msg))
+                return
+            except ConnectionClosed:
+                failed = ws
+    
+    async def execute(self, code: str, timeout: int = 120,
+                      interrupt: Optional[Callable[[], Awaitable[None]]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Send an execute_request and yield its replies until the kernel goes idle.
+        
+        Waits for earlier executions to finish first; the timeout starts once
+        this one is sent. If it ends before the kernel goes idle (timeout, the
+        caller stops reading) after the kernel started the cell, the cell is
+        stopped with interrupt and the next execution waits until the kernel
+        reports it idle, so the interrupt cannot hit that one instead.
+        """
+        async with self._executing:
+            async with aclosing(self._execute(code, timeout, interrupt)) as messages:
+                async for m in messages:
+                    yield m
+    
+    async def _execute(self, code: str, timeout: int,
+                       interrupt: Optional[Callable[[], Awaitable[None]]]) -> AsyncIterator[Dict[str, Any]]:
+        msg_id = uuid.uuid4().hex
+        msg = {
+            "header": {
+                "msg_id": msg_id,
+                "username": "user",
+                "session": self.session_id,
+                "date": "",
+                "msg_type": "execute_request",
+                "version": "5.3"
+            },
+            "parent_header": {},
+            "metadata": {},
+            "content": {
+                "code": code,
+                "silent": False,
+                "store_history": True,
+                "allow_stdin": False,
+                "stop_on_error": True
+            }
+        }
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[msg_id] = queue
+        deadline = time.time() + timeout
+        started = finished = False
+        try:
+            await self._send(msg, timeout)
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                try:
+                    m = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return
+                if m is None:
+                    return
+                started = True
+                finished = _is_idle(m)
+                yield m
+                if finished:
+                    return
+        finally:
+            try:
+                if started and not finished and interrupt is not None:
+                    # Shielded so the interrupt is still sent if the caller is cancelled again
+                    await asyncio.shield(self._stop(queue, interrupt))
+            finally:
+                self._pending.pop(msg_id, None)
+    
+    async def _stop(self, queue: asyncio.Queue, interrupt: Callable[[], Awaitable[None]]):
+        """Interrupt a started cell and drain its replies until the kernel is idle again"""
+        await interrupt()
+        deadline = time.time() + settings.KERNEL_INTERRUPT_TIMEOUT
+        try:
+            while True:
+                m = await asyncio.wait_for(queue.get(), max(deadline - time.time(), 0))
+                if m is None or _is_idle(m):
+                    return
+        except asyncio.TimeoutError:
+            pass
+    
+    def close(self):
+        """Close the channel; safe to call from any thread"""
+        self._closed = True
+        if self._supervisor is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._supervisor.cancel)
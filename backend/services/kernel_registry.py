@@ -0,0 +1,191 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+from ..core.config import settings
+from .conversation_store import connect_sqlite, immediate_transaction
+
+# Outcomes of KernelRegistry.claim
+ADOPT = "adopt"      # another worker's kernel is live, use it
+WAIT = "wait"        # another worker is starting or hibernating it, ask again shortly
+CLAIMED = "claimed"  # this worker now starts the kernel and must publish or abandon
+
+class KernelRegistry(ABC):
+    """Interface for the conversation -> kernel mapping shared between workers.
+    
+    A conversation has at most one row: either a live kernel or a claim held by
+    the worker starting or hibernating one. Claims carry a lease so a crashed
+    worker only blocks the conversation until it runs out. A hibernated
+    conversation keeps a row naming the gateway that holds its snapshot until
+    its next kernel is published.
+    """
+    
+    @abstractmethod
+    def claim(self, conv_id: str, lease: float) -> Tuple[str, Optional[Dict]]:
+        """Atomically find the conversation's kernel or claim the right to start it.
+        
+        ADOPT comes with {"kernel_id", "base_url"}; CLAIMED with {"snapshot": base_url}
+        if the conversation was hibernated on that gateway, else None.
+        """
+    
+    @abstractmethod
+    def publish(self, conv_id: str, kernel_id: str, base_url: str) -> bool:
+        """Map the conversation to the kernel this worker started under its claim.
+        
+        False if the claim was lost meanwhile (its lease ran out and another
+        worker claimed the conversation); the kernel is then not mapped.
+        """
+    
+    @abstractmethod
+    def abandon(self, conv_id: str, snapshot: Optional[str] = None):
+        """Drop this worker's claim without a kernel.
+        
+        snapshot names the gateway a hibernation just saved the conversation on;
+        a snapshot recorded earlier is kept for the next claim either way.
+        """
+    
+    @abstractmethod
+    def lookup(self, conv_id: str) -> Optional[Dict]:
+        """The conversation's live kernel as {"kernel_id", "base_url"}, or None"""
+    
+    @abstractmethod
+    def touch(self, conv_id: str, kernel_id: str, busy: int) -> bool:
+        """Mark the kernel used and add busy to its in-use count; False if it is no longer mapped"""
+    
+    @abstractmethod
+    def release(self, conv_id: str, kernel_id: str, idle_before: float, lease: float) -> bool:
+        """Unmap a kernel unused since idle_before and in use nowhere.
+        
+        With a lease the row turns into a claim of this worker, so others wait
+        for it to finish hibernating. False if another worker still uses it or
+        it is already gone.
+        """
+    
+    @abstractmethod
+    def remove(self, conv_id: str, kernel_id: str):
+        """Unmap a kernel unconditionally"""
+    
+    def close(self):
+        """Release resources"""
+
+class SQLiteKernelRegistry(KernelRegistry):
+    """Registry in a SQLite table; BEGIN IMMEDIATE serializes workers across processes"""
+    
+    def __init__(self, path: str, stale_after: float):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stale_after = stale_after  # in-use counts older than this are from crashed workers
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS kernels (
+                conv_id TEXT PRIMARY KEY,
+                kernel_id TEXT,
+                base_url TEXT,
+                owner TEXT,
+                lease_until REAL,
+                last_used REAL NOT NULL,
+                busy INTEGER NOT NULL DEFAULT 0,
+                snapshot TEXT
+            )
+        """)
+        if "snapshot" not in {row[1] for row in self._conn.execute("PRAGMA table_info(kernels)")}:
+            try:
+                self._conn.execute("ALTER TABLE kernels ADD COLUMN snapshot TEXT")
+            except sqlite3.OperationalError:
+                pass  # added by another worker meanwhile
+    
+    def claim(self, conv_id: str, lease: float) -> Tuple[str, Optional[Dict]]:
+        now = time.time()
+        with self._lock, immediate_transaction(self._conn) as conn:
+            row = conn.execute(
+                "SELECT kernel_id, base_url, owner, lease_until, snapshot FROM kernels WHERE conv_id = ?",
+                (conv_id,)
+            ).fetchone()
+            if row is not None and row[0] is not None:
+                return ADOPT, {"kernel_id": row[0], "base_url": row[1]}
+            if row is not None and row[2] is not None and row[2] != self.owner and row[3] > now:
+                return WAIT, None
+            snapshot = row[4] if row is not None else None
+            conn.execute(
+                "INSERT OR REPLACE INTO kernels "
+                "(conv_id, kernel_id, base_url, owner, lease_until, last_used, busy, snapshot) "
+                "VALUES (?, NULL, NULL, ?, ?, ?, 0, ?)",
+                (conv_id, self.owner, now + lease, now, snapshot)
+            )
+            return CLAIMED, {"snapshot": snapshot} if snapshot is not None else None
+    
+    def publish(self, conv_id: str, kernel_id: str, base_url: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE kernels SET kernel_id = ?, base_url = ?, lease_until = NULL, last_used = ?, busy = 0, "
+                "snapshot = NULL WHERE conv_id = ? AND owner = ? AND kernel_id IS NULL",
+                (kernel_id, base_url, time.time(), conv_id, self.owner)
+            )
+        return cursor.rowcount > 0
+    
+    def abandon(self, conv_id: str, snapshot: Optional[str] = None):
+        with self._lock, immediate_transaction(self._conn) as conn:
+            conn.execute(
+                "UPDATE kernels SET owner = NULL, lease_until = NULL, snapshot = COALESCE(?, snapshot) "
+                "WHERE conv_id = ? AND owner = ? AND kernel_id IS NULL",
+                (snapshot, conv_id, self.owner)
+            )
+            # Nothing left to remember about the conversation
+            conn.execute(
+                "DELETE FROM kernels "
+                "WHERE conv_id = ? AND kernel_id IS NULL AND owner IS NULL AND snapshot IS NULL",
+                (conv_id,)
+            )
+    
+    def lookup(self, conv_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kernel_id, base_url FROM kernels WHERE conv_id = ? AND kernel_id IS NOT NULL", (conv_id,)
+            ).fetchone()
+        return {"kernel_id": row[0], "base_url": row[1]} if row is not None else None
+    
+    def touch(self, conv_id: str, kernel_id: str, busy: int) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE kernels SET last_used = ?, busy = MAX(busy + ?, 0) WHERE conv_id = ? AND kernel_id = ?",
+                (time.time(), busy, conv_id, kernel_id)
+            )
+        return cur.rowcount > 0
+    
+    def release(self, conv_id: str, kernel_id: str, idle_before: float, lease: float) -> bool:
+        now = time.time()
+        with self._lock, immediate_transaction(self._conn) as conn:
+            row = conn.execute(
+                "SELECT last_used, busy FROM kernels WHERE conv_id = ? AND kernel_id = ?", (conv_id, kernel_id)
+            ).fetchone()
+            if row is None:
+                return False
+            last_used, busy = row
+            if last_used > idle_before or (busy and last_used > now - self.stale_after):
+                return False
+            if lease > 0:
+                conn.execute(
+                    "UPDATE kernels SET kernel_id = NULL, base_url = NULL, owner = ?, lease_until = ?, busy = 0 "
+                    "WHERE conv_id = ?",
+                    (self.owner, now + lease, conv_id)
+                )
+            else:
+                conn.execute("DELETE FROM kernels WHERE conv_id = ?", (conv_id,))
+            return True
+    
+    def remove(self, conv_id: str, kernel_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kernels WHERE conv_id = ? AND kernel_id = ?", (conv_id, kernel_id))
+    
+    def close(self):
+        self._conn.close()
+
+def create_kernel_registry() -> Optional[KernelRegistry]:
+    """The shared registry with SHARED_STATE, else None: kernels are tracked in process"""
+    if not settings.SHARED_STATE:
+        return None
+    return SQLiteKernelRegistry(settings.CONVERSATION_DB_PATH, stale_after=settings.JUPYTER_SESSION_TTL)
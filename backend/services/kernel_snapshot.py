@@ -0,0 +1,99 @@
+import hashlib
+import json
+import posixpath
+from typing import Dict, List, Optional
+
+# Runs inside the kernel. Values are pickled one by one so a single bad object
+# only loses itself; modules are recorded by name and re-imported on restore.
+_SNAPSHOT = '''
+def __localgpt_snapshot(path, max_bytes):
+    import json, os, types
+    try:
+        import cloudpickle as pickle
+    except ImportError:
+        import pickle
+    ip = get_ipython()
+    values, modules, skipped, size = {}, {}, [], 0
+    for name, value in list(ip.user_ns.items()):
+        if name.startswith("_") or name in ip.user_ns_hidden:
+            continue
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+            continue
+        try:
+            data = pickle.dumps(value)
+        except Exception:
+            skipped.append(name)
+            continue
+        if size + len(data) > max_bytes:
+            skipped.append(name)
+            continue
+        values[name] = data
+        size += len(data)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump({"values": values, "modules": modules, "skipped": skipped}, f)
+    os.replace(path + ".tmp", path)
+    print(json.dumps({"saved": len(values) + len(modules), "skipped": sorted(skipped), "bytes": size}))
+__localgpt_snapshot(__PATH__, __MAX_BYTES__)
+del __localgpt_snapshot
+'''
+
+_RESTORE = '''
+def __localgpt_restore(path):
+    import importlib, json, os, pickle
+    if not os.path.exists(path):
+        print(json.dumps(None))
+        return
+    try:
+        import cloudpickle
+    except ImportError:
+        pass
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    ns = get_ipython().user_ns
+    restored, lost = [], list(snapshot["skipped"])
+    for name, module in snapshot["modules"].items():
+        try:
+            ns[name] = importlib.import_module(module)
+            restored.append(name)
+        except Exception:
+            lost.append(name)
+    for name, data in snapshot["values"].items():
+        try:
+            ns[name] = pickle.loads(data)
+            restored.append(name)
+        except Exception:
+            lost.append(name)
+    os.remove(path)
+    print(json.dumps({"restored": sorted(restored), "lost": sorted(lost)}))
+__localgpt_restore(__PATH__)
+del __localgpt_restore
+'''
+
+def snapshot_path(directory: str, conv_id: str) -> str:
+    """Kernel-side snapshot file of a conversation"""
+    return posixpath.join(directory, hashlib.sha256(conv_id.encode()).hexdigest()[:32] + ".pkl")
+
+def snapshot_code(path: str, max_bytes: int) -> str:
+    return _SNAPSHOT.replace("__PATH__", repr(path)).replace("__MAX_BYTES__", str(int(max_bytes)))
+
+def restore_code(path: str) -> str:
+    return _RESTORE.replace("__PATH__", repr(path))
+
+def parse_report(output: str) -> Optional[Dict]:
+    """The JSON report printed on the last line of a snapshot or restore run"""
+    lines = output.strip().splitlines()
+    try:
+        return json.loads(lines[-1]) if lines else None
+    except ValueError:
+        return None
+
+def restore_note(report: Dict) -> str:
+    """Tell the model what came back after a kernel was hibernated"""
+    restored: List[str] = report.get("restored", [])
+    lost: List[str] = report.get("lost", [])
+    note = f"[Kernel was restarted after being idle; {len(restored)} names restored"
+    if lost:
+        note += f", not restored (could not be saved): {', '.join(lost)}"
+    return note + "]\n"
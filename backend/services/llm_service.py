@@ -1,144 +1,368 @@
+import asyncio
 import json
 import time
-from typing import List, Dict, Any, Iterator
-from openai import OpenAI
+from contextlib import aclosing
+from typing import List, Dict, Any, AsyncIterator, Optional, Set, Tuple
+from openai import NOT_GIVEN, AsyncOpenAI
 from ..core.config import settings
-from ..core.models import StreamEvent
+from ..core.models import ChatEvent, ContentEvent, StreamEvent
+from ..core.metrics import Counter, Histogram
 from ..tools.tool_registry import ToolRegistry
+from .conversation_store import ConversationStore
+from .context_manager import ContextManager, summarize_prompt
+from .slot_allocator import SlotAllocator
+from .scheduler import ConversationBusyError, Scheduler, TurnQueue, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+
+TTFT_SECONDS = Histogram("localgpt_ttft_seconds", "Time from the start of a streamed turn to its first token")
+TURN_SECONDS = Histogram("localgpt_turn_seconds", "Total latency of a chat turn", ["endpoint"])
+TOKENS_PER_SECOND = Histogram("localgpt_llm_tokens_per_second", "Generation speed of each completion",
+                              buckets=(1, 2.5, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500))
+TOKENS = Counter("localgpt_llm_tokens_total", "Tokens reported by the LLM backend", ["type"])
+
+_ttft = TTFT_SECONDS.labels()
+_turn_stream = TURN_SECONDS.labels("stream")
+_turn_sync = TURN_SECONDS.labels("sync")
+_tokens_per_second = TOKENS_PER_SECOND.labels()
+_prompt_tokens = TOKENS.labels("prompt")
+_completion_tokens = TOKENS.labels("completion")
 
 class LLMService:
-    def __init__(self, tool_registry: ToolRegistry):
-        self.client = OpenAI(base_url=settings.OPENAI_BASE, api_key=settings.OPENAI_KEY)
+    def __init__(self, tool_registry: ToolRegistry, conversation_store: ConversationStore):
+        self.client = AsyncOpenAI(base_url=settings.OPENAI_BASE, api_key=settings.OPENAI_KEY)
         self.tool_registry = tool_registry
-        self._conversations: Dict[str, List[Dict]] = {}
+        self.conversation_store = conversation_store
+        self.context_manager = ContextManager(self._summarize)
+        self.slot_allocator = SlotAllocator(settings.LLAMA_SLOTS)
+        self.scheduler = Scheduler(settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE)
+        self.turns = TurnQueue(settings.CONVERSATION_MAX_WAITING_TURNS)
+        self._turns: Dict[str, asyncio.Task] = {}  # conv_id -> task driving its streamed turn
+        self._cancel_requested: Set[asyncio.Task] = set()
     
-    def get_conversation(self, conv_id: str) -> List[Dict]:
-        """Get or create conversation history"""
-        if conv_id not in self._conversations:
-            self._conversations[conv_id] = [
+    async def get_conversation(self, conv_id: str, create: bool = True) -> List[Dict]:
+        """Get (or create) conversation history"""
+        # Stores may block on SQLite, so they run in a thread
+        messages = await asyncio.to_thread(self.conversation_store.get, conv_id)
+        if messages is None and create:
+            messages = [
                 {"role": "system", "content": "You can call the python and browser tools. Use %pip to install packages if needed."}
             ]
-        return self._conversations[conv_id]
+            await asyncio.to_thread(self.conversation_store.append, conv_id, messages)
+        return messages or []
     
-    def save_conversation(self, conv_id: str, messages: List[Dict]):
-        """Save conversation history"""
-        self._conversations[conv_id] = messages
+    async def append_messages(self, conv_id: str, messages: List[Dict]):
+        """Append the messages of a finished turn to the conversation history"""
+        await asyncio.to_thread(self.conversation_store.append, conv_id, messages)
     
-    def delete_conversation(self, conv_id: str):
-        """Delete conversation history"""
-        self._conversations.pop(conv_id, None)
+    async def delete_conversation(self, conv_id: str):
+        """Delete conversation history and shut down its kernel"""
+        await asyncio.to_thread(self.conversation_store.delete, conv_id)
+        self.context_manager.forget(conv_id)
+        self.slot_allocator.forget(conv_id)
+        self.tool_registry.forget(conv_id)
+        jupyter_service = self.tool_registry.jupyter_service
+        await asyncio.to_thread(jupyter_service.forget, conv_id)
+        # Otherwise the kernel would count against KERNEL_MAX_LIVE until its TTL
+        await jupyter_service.jupyter_gateway_service.cleanup_session(conv_id)
     
-    def list_conversations(self) -> List[str]:
+    async def list_conversations(self) -> List[str]:
         """List all conversation IDs"""
-        return list(self._conversations.keys())
+        return await asyncio.to_thread(self.conversation_store.list_ids)
     
-    def chat_sync(self, conv_id: str, message: str) -> str:
-        """Synchronous chat completion"""
-        messages = self.get_conversation(conv_id).copy()
-        messages.append({"role": "user", "content": message})
+    def cancel(self, conv_id: str, notify: bool = True) -> bool:
+        """Cancel the conversation's streamed turn, if one is running.
         
-        # Initial LLM call
-        resp = self.client.chat.completions.create(
+        The upstream completion is closed, running tools are cancelled and the
+        partial turn is saved. With notify the stream ends with a "cancelled"
+        event; without it (the client is gone) the stream just stops.
+        """
+        task = self._turns.get(conv_id)
+        if task is None or task.done():
+            return False
+        if notify:
+            self._cancel_requested.add(task)
+        task.cancel()
+        return True
+    
+    async def _save_cancelled_turn(self, conv_id: str, new_messages: List[Dict], calls: List[Dict],
+                             results: Dict[int, str], content: str):
+        """Save what a cancelled turn produced, closed off so the history stays valid"""
+        new_messages = list(new_messages)
+        if new_messages[-1].get("tool_calls"):
+            # Every tool call needs a result, even the ones that never finished
+            for i, tool_call in enumerate(calls):
+                new_messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "content": results.get(i, "[cancelled]")
+                })
+        new_messages.append({"role": "assistant", "content": content})
+        await self.append_messages(conv_id, new_messages)
+    
+    async def _completion(self, conv_id: str, messages: List[Dict], slot: Optional[int],
+                          stream: bool = False, tool_choice: str = "auto"):
+        """Request a completion for the conversation's trimmed history on its pinned slot.
+        
+        Tools are always sent (tool_choice="none" for final answers) so every request
+        of a conversation shares the same prompt prefix and hits the slot's KV cache.
+        """
+        extra_body = {"id_slot": slot, "cache_prompt": True} if slot is not None else None
+        # Streams only report token usage when asked for it
+        stream_options = {"stream_options": {"include_usage": True}} if stream else {}
+        tools = self.tool_registry.get_tool_definitions(conv_id)
+        return await self.client.chat.completions.create(
             model=settings.MODEL_NAME,
-            messages=messages,
-            tools=self.tool_registry.get_tool_definitions(),
-            tool_choice="auto",
-            temperature=settings.TEMPERATURE
+            messages=await self.context_manager.build(conv_id, messages),
+            tools=tools or NOT_GIVEN,
+            tool_choice=tool_choice if tools else NOT_GIVEN,
+            temperature=settings.TEMPERATURE,
+            stream=stream,
+            extra_body=extra_body,
+            **stream_options
         )
+    
+    @staticmethod
+    def _record_usage(usage: Any) -> int:
+        """Count reported token usage; returns the completion tokens (0 if not reported)"""
+        if usage is None:
+            return 0
+        _prompt_tokens.inc(usage.prompt_tokens or 0)
+        _completion_tokens.inc(usage.completion_tokens or 0)
+        return usage.completion_tokens or 0
+    
+    async def _scheduled_completion(self, conv_id: str, messages: List[Dict], slot: Optional[int],
+                                    priority: int, tool_choice: str = "auto"):
+        """Non-streaming completion run under the scheduler"""
+        async with self.scheduler.slot(priority):
+            started = time.perf_counter()
+            resp = await self._completion(conv_id, messages, slot, tool_choice=tool_choice)
+            elapsed = time.perf_counter() - started
+        self.slot_allocator.record_timings(getattr(resp, "timings", None))
+        generated = self._record_usage(getattr(resp, "usage", None))
+        if generated and elapsed > 0:
+            _tokens_per_second.observe(generated / elapsed)
+        return resp
+    
+    async def _scheduled_stream(self, conv_id: str, messages: List[Dict], slot: Optional[int],
+                                priority: int, tool_choice: str = "auto") -> AsyncIterator[Any]:
+        """Streaming completion whose scheduler slot is held until the stream ends"""
+        async with self.scheduler.slot(priority):
+            resp = await self._completion(conv_id, messages, slot, stream=True, tool_choice=tool_choice)
+            first_chunk_at, pieces, generated = None, 0, 0
+            try:
+                async for chunk in resp:
+                    self.slot_allocator.record_timings(getattr(chunk, "timings", None))
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        generated = self._record_usage(usage)
+                    if chunk.choices:
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                        pieces += 1
+                        yield chunk
+                
+                # Generation speed over the decode phase; falls back to chunk count without usage
+                if first_chunk_at is not None:
+                    elapsed = time.perf_counter() - first_chunk_at
+                    if elapsed > 0:
+                        _tokens_per_second.observe((generated or pieces) / elapsed)
+            finally:
+                # Stop generation upstream if the caller goes away mid-stream
+                await resp.close()
+    
+    async def _summarize(self, conv_id: str, messages: List[Dict]) -> str:
+        """Summarise older turns that no longer fit in the context budget.
+        
+        Runs on the conversation's own slot: its prompt prefix changes with the
+        summary anyway, so no other conversation's cache is evicted.
+        """
+        slot = self.slot_allocator.acquire(conv_id)
+        try:
+            resp = await self.client.chat.completions.create(
+                model=settings.MODEL_NAME,
+                messages=summarize_prompt(messages),
+                temperature=0,
+                extra_body={"id_slot": slot} if slot is not None else None
+            )
+        finally:
+            self.slot_allocator.release(slot)
+        self.slot_allocator.record_timings(getattr(resp, "timings", None))
+        return resp.choices[0].message.content or ""
+    
+    async def _run_tool_calls(self, tool_calls: List[Dict], conv_id: str,
+                              stream_output: bool = False) -> AsyncIterator[Tuple[int, str, str]]:
+        """Run tool calls concurrently, yielding (index, kind, text) as they progress.
+        
+        kind is "done" with the full result once a call finishes; with stream_output
+        the incremental output chunks of streaming tools are yielded as well.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def run(index: int, call: Dict):
+            on_output = None
+            if stream_output:
+                on_output = lambda kind, text: queue.put_nowait((index, kind, text))
+            try:
+                args = json.loads(call["function"]["arguments"] or "{}")
+            except ValueError as e:
+                queue.put_nowait((index, "done", f"Invalid tool arguments: {e}"))
+                return
+            result = await self.tool_registry.execute_tool(
+                call["function"]["name"], args, conv_id, on_output=on_output
+            )
+            queue.put_nowait((index, "done", result))
+        
+        # Tasks start in submission order, which keeps per-conversation tool locks FIFO
+        tasks = [asyncio.create_task(run(i, call)) for i, call in enumerate(tool_calls)]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                index, kind, text = await queue.get()
+                if kind == "done":
+                    remaining -= 1
+                yield index, kind, text
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def chat_sync(self, conv_id: str, message: str, priority: int = PRIORITY_NORMAL) -> str:
+        """Non-streaming chat completion.
+        
+        Raises QueueFullError if the backend is saturated and ConversationBusyError
+        if the conversation already has too many turns waiting.
+        """
+        self.scheduler.check_admission()
+        started = time.perf_counter()
+        async with self.turns.turn(conv_id):
+            history = await self.get_conversation(conv_id)
+            messages = history + [{"role": "user", "content": message}]
+            
+            slot = self.slot_allocator.acquire(conv_id)
+            try:
+                content = await self._chat_sync(conv_id, history, messages, slot, priority)
+                _turn_sync.observe(time.perf_counter() - started)
+                return content
+            finally:
+                self.slot_allocator.release(slot)
+    
+    async def _chat_sync(self, conv_id: str, history: List[Dict], messages: List[Dict],
+                         slot: Optional[int], priority: int) -> str:
+        """Run one non-streaming turn on an acquired slot"""
+        # Initial LLM call
+        resp = await self._scheduled_completion(conv_id, messages, slot, priority)
         
         msg = resp.choices[0].message
         
         # If no tool calls, return immediately
         if not getattr(msg, "tool_calls", None):
-            self.save_conversation(conv_id, messages + [{"role": "assistant", "content": msg.content}])
+            await self.append_messages(conv_id, messages[len(history):] + [{"role": "assistant", "content": msg.content}])
             return msg.content
         
         # Handle tool calls
+        tool_calls = [call.model_dump() for call in msg.tool_calls]
         messages.append({
             "role": "assistant", 
-            "tool_calls": msg.tool_calls, 
+            "tool_calls": tool_calls, 
             "content": msg.content
         })
         
-        # Execute all tool calls
-        for call in msg.tool_calls:
-            result = self.tool_registry.execute_tool(
-                call.function.name, 
-                json.loads(call.function.arguments or "{}"), 
-                conv_id
-            )
+        # Execute all tool calls concurrently, then record results in call order
+        results = {
+            index: text
+            async for index, kind, text in self._run_tool_calls(tool_calls, conv_id)
+            if kind == "done"
+        }
+        for i, call in enumerate(tool_calls):
             messages.append({
                 "role": "tool",
-                "tool_call_id": call.id,
-                "name": call.function.name,
-                "content": result
+                "tool_call_id": call["id"],
+                "name": call["function"]["name"],
+                "content": results[i]
             })
         
         # Get final response after tool execution
-        final_resp = self.client.chat.completions.create(
-            model=settings.MODEL_NAME,
-            messages=messages,
-            temperature=settings.TEMPERATURE
-        )
+        final_resp = await self._scheduled_completion(conv_id, messages, slot, priority, tool_choice="none")
         
         final_msg = final_resp.choices[0].message
-        self.save_conversation(conv_id, messages + [{"role": "assistant", "content": final_msg.content}])
+        await self.append_messages(conv_id, messages[len(history):] + [{"role": "assistant", "content": final_msg.content}])
         return final_msg.content
     
-    def chat_stream(self, conv_id: str, message: str) -> Iterator[StreamEvent]:
-        """Streaming chat completion"""
-        messages = self.get_conversation(conv_id).copy()
-        messages.append({"role": "user", "content": message})
-        
+    async def chat_stream(self, conv_id: str, message: str,
+                          priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[ChatEvent]:
+        """Streaming chat completion; callers check admission and the turn queue before starting the stream"""
         # Send conversation ID first
         yield StreamEvent(type="conversation_id", conversation_id=conv_id)
         
+        started = time.perf_counter()
+        try:
+            # Checked by the route too, but more turns may have queued up since
+            self.turns.check(conv_id)
+        except ConversationBusyError as e:
+            yield StreamEvent(type="error", error=str(e))
+            return
+        async with self.turns.turn(conv_id):
+            async with aclosing(self._chat_stream(conv_id, message, priority, started)) as events:
+                async for event in events:
+                    yield event
+    
+    async def _chat_stream(self, conv_id: str, message: str, priority: int,
+                           started: float) -> AsyncIterator[ChatEvent]:
+        """Run one streamed turn once it is the conversation's turn"""
+        history = await self.get_conversation(conv_id)
+        messages = history + [{"role": "user", "content": message}]
+        
+        task = asyncio.current_task()
+        self._turns[conv_id] = task
+        slot = self.slot_allocator.acquire(conv_id)
+        accumulated_content = final_content = ""
+        calls, results, saved = [], {}, False
+        prepared: Set[str] = set()  # tools whose preparation was started speculatively
         try:
             # Initial LLM call (streaming)
-            resp = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages,
-                tools=self.tool_registry.get_tool_definitions(),
-                tool_choice="auto",
-                temperature=settings.TEMPERATURE,
-                stream=True
-            )
-            
-            accumulated_content = ""
             tool_calls_data = []
+            first_token = True
             
-            for chunk in resp:
-                delta = chunk.choices[0].delta
-                
-                # Handle content streaming
-                if hasattr(delta, 'content') and delta.content:
-                    accumulated_content += delta.content
-                    yield StreamEvent(type="content", content=delta.content)
-                
-                # Handle tool calls
-                if hasattr(delta, 'tool_calls') and delta.tool_calls:
-                    for tool_call in delta.tool_calls:
-                        if tool_call.index is not None:
-                            # Ensure we have enough tool calls in our list
-                            while len(tool_calls_data) <= tool_call.index:
-                                tool_calls_data.append({
-                                    "id": None, 
-                                    "type": "function", 
-                                    "function": {"name": "", "arguments": ""}
-                                })
-                            
-                            current_tool_call = tool_calls_data[tool_call.index]
-                            
-                            if tool_call.id:
-                                current_tool_call["id"] = tool_call.id
-                            
-                            if tool_call.function:
-                                if tool_call.function.name:
-                                    current_tool_call["function"]["name"] = tool_call.function.name
-                                    yield StreamEvent(type="tool_start", tool_name=tool_call.function.name)
+            async with aclosing(self._scheduled_stream(conv_id, messages, slot, priority)) as stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta
+                    if first_token and (delta.content or delta.tool_calls):
+                        first_token = False
+                        _ttft.observe(time.perf_counter() - started)
+                    
+                    # Handle content streaming
+                    if hasattr(delta, 'content') and delta.content:
+                        accumulated_content += delta.content
+                        yield ContentEvent(delta.content)
+                    
+                    # Handle tool calls
+                    if hasattr(delta, 'tool_calls') and delta.tool_calls:
+                        for tool_call in delta.tool_calls:
+                            if tool_call.index is not None:
+                                # Ensure we have enough tool calls in our list
+                                while len(tool_calls_data) <= tool_call.index:
+                                    tool_calls_data.append({
+                                        "id": None, 
+                                        "type": "function", 
+                                        "function": {"name": "", "arguments": ""}
+                                    })
+                                
+                                current_tool_call = tool_calls_data[tool_call.index]
                                 
-                                if tool_call.function.arguments:
-                                    current_tool_call["function"]["arguments"] += tool_call.function.arguments
+                                if tool_call.id:
+                                    current_tool_call["id"] = tool_call.id
+                                
+                                if tool_call.function:
+                                    if tool_call.function.name:
+                                        current_tool_call["function"]["name"] = tool_call.function.name
+                                        yield StreamEvent(type="tool_start", tool_name=tool_call.function.name)
+                                        # Get the tool ready while its arguments are still streaming
+                                        name = tool_call.function.name
+                                        if name not in prepared:
+                                            prepared.add(name)
+                                            self.tool_registry.prepare(name, conv_id)
+                                    
+                                    if tool_call.function.arguments:
+                                        current_tool_call["function"]["arguments"] += tool_call.function.arguments
             
             # If we have tool calls, execute them
             if tool_calls_data and any(tc["id"] for tc in tool_calls_data):
@@ -151,54 +375,85 @@ class LLMService:
                     "tool_calls": tool_calls_data
                 })
                 
-                # Execute each tool call
-                for tool_call in tool_calls_data:
-                    if tool_call["id"]:
-                        yield StreamEvent(type="tool_executing", tool_name=tool_call['function']['name'])
-                        
-                        result = self.tool_registry.execute_tool(
-                            tool_call["function"]["name"], 
-                            json.loads(tool_call["function"]["arguments"] or "{}"), 
-                            conv_id
+                # Execute tool calls concurrently, reporting each result as it lands
+                calls = [tool_call for tool_call in tool_calls_data if tool_call["id"]]
+                for tool_call in calls:
+                    yield StreamEvent(
+                        type="tool_executing",
+                        tool_name=tool_call['function']['name'],
+                        tool_call_id=tool_call["id"]
+                    )
+                
+                preview = settings.TOOL_RESULT_PREVIEW_CHARS
+                async for i, kind, text in self._run_tool_calls(calls, conv_id, stream_output=True):
+                    if kind == "artifact":
+                        yield StreamEvent(
+                            type="tool_artifact",
+                            tool_name=calls[i]['function']['name'],
+                            tool_call_id=calls[i]["id"],
+                            artifact=json.loads(text)
                         )
-                        
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call["id"],
-                            "name": tool_call["function"]["name"],
-                            "content": result
-                        })
-                        
+                        continue
+                    if kind != "done":
                         yield StreamEvent(
-                            type="tool_result", 
-                            tool_name=tool_call['function']['name'], 
-                            result=result[:200] + '...' if len(result) > 200 else result
+                            type="tool_output",
+                            tool_name=calls[i]['function']['name'],
+                            tool_call_id=calls[i]["id"],
+                            stream=kind,
+                            content=text
                         )
+                        continue
+                    results[i] = text
+                    yield StreamEvent(
+                        type="tool_result", 
+                        tool_name=calls[i]['function']['name'], 
+                        tool_call_id=calls[i]["id"],
+                        result=text[:preview] + '...' if len(text) > preview else text
+                    )
+                
+                # Append results in the original tool_call_id order
+                for i, tool_call in enumerate(calls):
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "name": tool_call["function"]["name"],
+                        "content": results[i]
+                    })
                 
                 # Get final streaming response after tool execution
                 yield StreamEvent(type="final_response_start")
                 
-                final_resp = self.client.chat.completions.create(
-                    model=settings.MODEL_NAME,
-                    messages=messages,
-                    temperature=settings.TEMPERATURE,
-                    stream=True
-                )
-                
-                final_content = ""
-                for chunk in final_resp:
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, 'content') and delta.content:
-                        final_content += delta.content
-                        yield StreamEvent(type="content", content=delta.content)
+                async with aclosing(self._scheduled_stream(conv_id, messages, slot, priority, tool_choice="none")) as stream:
+                    async for chunk in stream:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, 'content') and delta.content:
+                            final_content += delta.content
+                            yield ContentEvent(delta.content)
                 
                 # Save final conversation state
-                self.save_conversation(conv_id, messages + [{"role": "assistant", "content": final_content}])
+                await self.append_messages(conv_id, messages[len(history):] + [{"role": "assistant", "content": final_content}])
             else:
                 # No tool calls, save the direct response
-                self.save_conversation(conv_id, messages + [{"role": "assistant", "content": accumulated_content}])
+                await self.append_messages(conv_id, messages[len(history):] + [{"role": "assistant", "content": accumulated_content}])
+            saved = True
             
+            _turn_stream.observe(time.perf_counter() - started)
             yield StreamEvent(type="complete")
-            
+        
+        except (asyncio.CancelledError, GeneratorExit) as e:
+            if not saved:
+                # Text streamed since the last message the turn already holds
+                content = accumulated_content if messages[-1]["role"] == "user" else final_content
+                await self._save_cancelled_turn(conv_id, messages[len(history):], calls, results, content)
+            if isinstance(e, GeneratorExit) or task not in self._cancel_requested:
+                raise
+            # Cancelled through cancel(): finish the stream normally
+            task.uncancel()
+            yield StreamEvent(type="cancelled")
         except Exception as e:
-            yield StreamEvent(type="error", error=str(e))
\ No newline at end of file
+            yield StreamEvent(type="error", error=str(e))
+        finally:
+            self.slot_allocator.release(slot)
+            self._cancel_requested.discard(task)
+            if self._turns.get(conv_id) is task:
+                del self._turns[conv_id]
@@ -0,0 +1,167 @@
+import asyncio
+import codecs
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from collections import deque
+from typing import Deque, List, Optional, TextIO, Tuple
+from ..core.metrics import Counter
+
+OUTPUT_SPILLED = Counter("localgpt_tool_output_spilled_total", "Tool outputs too long for the prompt, saved to disk")
+
+_HANDLE = re.compile(r"^out-[0-9a-f]{12}$")
+
+# Spilled text is written from a thread in batches of about this many characters
+SPILL_BATCH_CHARS = 64 * 1024
+
+class OutputStore:
+    """Per-conversation directory of tool outputs too long to keep in memory or the prompt"""
+    
+    def __init__(self, directory: str, max_chars: int):
+        self.directory = directory
+        self.max_chars = max_chars  # per output; the rest is dropped
+    
+    def _dir(self, conv_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(conv_id.encode()).hexdigest()[:32])
+    
+    def new_handle(self) -> str:
+        """A handle for a new output; its file is created by open()"""
+        OUTPUT_SPILLED.inc()
+        return f"out-{uuid.uuid4().hex[:12]}"
+    
+    def open(self, conv_id: str, handle: str) -> TextIO:
+        """The file of a new output, open for writing"""
+        os.makedirs(self._dir(conv_id), exist_ok=True)
+        return open(os.path.join(self._dir(conv_id), handle), "w", encoding="utf-8")
+    
+    def read(self, conv_id: str, handle: str, offset: int, max_chars: int) -> Optional[Tuple[str, int, int]]:
+        """(text, end offset, file size) of up to max_chars characters from byte offset on.
+        
+        Pages end on a character boundary, so the end offset is where the next
+        one starts. None if there is no such output.
+        """
+        if not _HANDLE.match(handle):
+            return None
+        try:
+            with open(os.path.join(self._dir(conv_id), handle), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                f.seek(offset)
+                data = f.read(max_chars * 4)  # a character takes at most 4 bytes in UTF-8
+        except FileNotFoundError:
+            return None
+        # An offset not handed out by a previous page may point inside a character
+        start = 0
+        while start < len(data) and data[start] & 0xC0 == 0x80:
+            start += 1
+        # The incremental decoder holds back a character cut off at the end of data
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace").decode(data[start:])[:max_chars]
+        return text, offset + start + len(text.encode("utf-8")), size
+    
+    def delete(self, conv_id: str):
+        shutil.rmtree(self._dir(conv_id), ignore_errors=True)
+
+class OutputCapture:
+    """Bounded capture of one output stream.
+    
+    The first head_chars and the last tail_chars stay in memory. Once the
+    stream outgrows both, everything seen so far and all that follows is
+    saved to a spill file in the store, and text() returns head and tail
+    around a note naming the file's handle.
+    
+    write() only buffers what is to be spilled; the owner awaits flush() when
+    pending_chars grows large and close() at the end, which write the file
+    from a thread so the event loop never blocks on disk.
+    """
+    
+    def __init__(self, head_chars: int, tail_chars: int, store: Optional[OutputStore] = None,
+                 conv_id: Optional[str] = None):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.store = store
+        self.conv_id = conv_id
+        self.total = 0
+        self.handle: Optional[str] = None
+        self._head: List[str] = []
+        self._head_len = 0
+        self._tail: Deque[str] = deque()
+        self._tail_len = 0
+        self._file: Optional[TextIO] = None
+        self._buffer: List[str] = []
+        self.pending_chars = 0  # buffered for the spill file, not written yet
+        self._spilled = 0
+        self._spill_truncated = False
+    
+    def write(self, text: str):
+        self.total += len(text)
+        if self._head_len < self.head_chars:
+            part = text[:self.head_chars - self._head_len]
+            self._head.append(part)
+            self._head_len += len(part)
+            text = text[len(part):]
+            if not text:
+                return
+        self._tail.append(text)
+        self._tail_len += len(text)
+        
+        if self.handle is not None:
+            self._spill(text)
+        elif self.total > self.head_chars + self.tail_chars and self.store is not None:
+            # Nothing has been dropped yet, so head and tail still hold all of it
+            self.handle = self.store.new_handle()
+            self._spill("".join(self._head))
+            for chunk in self._tail:
+                self._spill(chunk)
+        
+        while self._tail_len - len(self._tail[0]) >= self.tail_chars:
+            self._tail_len -= len(self._tail.popleft())
+        if self._tail_len > self.tail_chars:
+            cut = self._tail_len - self.tail_chars
+            self._tail[0] = self._tail[0][cut:]
+            self._tail_len -= cut
+    
+    def _spill(self, text: str):
+        if self._spilled >= self.store.max_chars:
+            self._spill_truncated = True
+            return
+        data = text[:self.store.max_chars - self._spilled]
+        self._buffer.append(data)
+        self.pending_chars += len(data)
+        self._spilled += len(data)
+        self._spill_truncated = len(data) < len(text)
+    
+    def _write(self, data: str):
+        if self._file is None:
+            self._file = self.store.open(self.conv_id, self.handle)
+        self._file.write(data)
+    
+    async def flush(self):
+        """Write buffered spill text to the file"""
+        if not self._buffer:
+            return
+        data = "".join(self._buffer)
+        self._buffer.clear()
+        self.pending_chars = 0
+        await asyncio.to_thread(self._write, data)
+    
+    async def close(self):
+        """Flush and close the spill file"""
+        await self.flush()
+        if self._file is not None:
+            file, self._file = self._file, None
+            await asyncio.to_thread(file.close)
+    
+    def text(self) -> str:
+        """All of the output if it fit, else its head and tail around a note"""
+        head, tail = "".join(self._head), "".join(self._tail)
+        omitted = self.total - len(head) - len(tail)
+        if omitted <= 0:
+            return head + tail
+        note = f"\n[... {omitted} characters omitted, {self.total} in total"
+        if self.handle is not None:
+            note += f"; full output saved as {self.handle}"
+            if self._spill_truncated:
+                note += f" (first {self._spilled} characters)"
+            note += f", read it with the output tool: {{\"handle\": \"{self.handle}\", \"offset\": 0}}"
+        return head + note + " ...]\n" + tail
@@ -0,0 +1,182 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List
+from ..core.metrics import Counter, Gauge, Histogram
+
+# Lanes are served in order: a waiting interactive request always goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = ["interactive", "normal", "batch"]
+
+QUEUE_DEPTH = Gauge("localgpt_llm_queue_depth", "Requests waiting for an LLM slot", ["priority"])
+RUNNING = Gauge("localgpt_llm_running", "Completions currently running on the LLM backend")
+QUEUE_WAIT_SECONDS = Histogram("localgpt_llm_queue_wait_seconds", "Time spent waiting for an LLM slot", ["priority"])
+REJECTED = Counter("localgpt_llm_rejected_total", "Turns refused because the wait queue was full")
+TURNS_WAITING = Gauge("localgpt_turns_waiting", "Turns waiting for an earlier turn of their conversation")
+TURNS_REJECTED = Counter("localgpt_turns_rejected_total", "Turns refused because their conversation's queue was full")
+
+class QueueFullError(Exception):
+    """Raised when the scheduler cannot queue another request"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM backend busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class ConversationBusyError(Exception):
+    """Raised when a conversation cannot queue another turn"""
+    
+    def __init__(self, conv_id: str, pending: int, retry_after: int = 1):
+        super().__init__(f"Conversation {conv_id} already has {pending} turn(s) running or waiting")
+        self.retry_after = retry_after
+
+class Scheduler:
+    """Admission control in front of the LLM backend.
+    
+    At most max_concurrency completions run at once (match llama-server's
+    slots). Further requests wait in per-priority FIFO lanes; once max_queue
+    requests are waiting, new turns are refused so clients get a fast 429.
+    """
+    
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._running = 0
+        self._lanes: List[Deque[asyncio.Future]] = [deque() for _ in PRIORITY_NAMES]
+        self._avg_service_time = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        
+        self._wait_seconds = [QUEUE_WAIT_SECONDS.labels(name) for name in PRIORITY_NAMES]
+        self._rejected = REJECTED.labels()
+        for name, lane in zip(PRIORITY_NAMES, self._lanes):
+            QUEUE_DEPTH.labels(name).set_function(lane.__len__)
+        RUNNING.set_function(lambda: self._running)
+    
+    @property
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+    
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely be served"""
+        backlog = (self.queued + 1) / max(self.max_concurrency, 1)
+        return max(1, math.ceil(backlog * self._avg_service_time))
+    
+    def check_admission(self):
+        """Refuse a new turn up front if the wait queue is full"""
+        if self._running >= self.max_concurrency and self.queued >= self.max_queue:
+            self.rejected += 1
+            self._rejected.inc()
+            raise QueueFullError(self.retry_after())
+    
+    async def _acquire(self, priority: int):
+        if self._running < self.max_concurrency and not self.queued:
+            self._running += 1
+            self._wait_seconds[priority].observe(0)
+            return
+        
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes[priority]
+        lane.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled; pass it on
+                self._release()
+            elif future in lane:
+                # _release may already have dropped it
+                lane.remove(future)
+            raise
+        self._wait_seconds[priority].observe(time.monotonic() - started)
+    
+    def _release(self):
+        for lane in self._lanes:
+            while lane:
+                future = lane.popleft()
+                if not future.done():
+                    # Hand the slot straight to the next waiter
+                    future.set_result(None)
+                    return
+        self._running -= 1
+    
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL) -> AsyncIterator[None]:
+        """Hold one LLM concurrency slot for the duration of the block"""
+        await self._acquire(priority)
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._avg_service_time = 0.9 * self._avg_service_time + 0.1 * (time.monotonic() - started)
+            self._release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Concurrency, queue depth per lane and admission counters"""
+        return {
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "queued": {name: len(lane) for name, lane in zip(PRIORITY_NAMES, self._lanes)},
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+class TurnQueue:
+    """Runs the turns of each conversation one at a time, in arrival order.
+    
+    Each turn then starts from the history the previous one saved. Up to
+    max_waiting turns wait behind the running one; further turns on the
+    conversation are refused up front. Conversations never wait on each other.
+    """
+    
+    def __init__(self, max_waiting: int):
+        self.max_waiting = max_waiting
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pending: Dict[str, int] = {}  # turns running or waiting, per conversation
+        self.rejected = 0
+        self._rejected = TURNS_REJECTED.labels()
+        TURNS_WAITING.set_function(lambda: self.waiting)
+    
+    @property
+    def waiting(self) -> int:
+        return sum(pending - 1 for pending in self._pending.values())
+    
+    def check(self, conv_id: str):
+        """Refuse a new turn up front if the conversation's queue is full"""
+        pending = self._pending.get(conv_id, 0)
+        if pending > self.max_waiting:
+            self.rejected += 1
+            self._rejected.inc()
+            raise ConversationBusyError(conv_id, pending)
+    
+    @asynccontextmanager
+    async def turn(self, conv_id: str) -> AsyncIterator[None]:
+        """Hold the conversation for the duration of the block"""
+        self.check(conv_id)
+        lock = self._locks.get(conv_id)
+        if lock is None:
+            lock = self._locks[conv_id] = asyncio.Lock()
+        self._pending[conv_id] = self._pending.get(conv_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._pending[conv_id] -= 1
+            if not self._pending[conv_id]:
+                del self._pending[conv_id]
+                del self._locks[conv_id]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Busy conversations, waiting turns and rejections"""
+        return {
+            "conversations": len(self._pending),
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "rejected": self.rejected
+        }
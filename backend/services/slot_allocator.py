@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class SlotAllocator:
+    """Pins conversations to llama-server slots so each turn can reuse the slot's KV cache.
+    
+    Assignments are kept in LRU order. A new conversation takes a free slot if
+    there is one, otherwise the slot of the least recently used conversation
+    that is not mid-request, so concurrent conversations don't evict each
+    other's prompt prefixes.
+    """
+    
+    def __init__(self, n_slots: int):
+        self.n_slots = n_slots
+        self._assignments: "OrderedDict[str, int]" = OrderedDict()
+        self._in_flight: Dict[int, int] = {slot: 0 for slot in range(n_slots)}
+        self.reassignments = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.n_slots > 0
+    
+    def acquire(self, conv_id: str) -> Optional[int]:
+        """Get the conversation's slot, assigning one if needed, and mark it in use"""
+        if not self.enabled:
+            return None
+        
+        slot = self._assignments.get(conv_id)
+        if slot is None:
+            slot = self._pick_slot()
+            self._assignments[conv_id] = slot
+        self._assignments.move_to_end(conv_id)
+        self._in_flight[slot] += 1
+        return slot
+    
+    def _pick_slot(self) -> int:
+        taken = set(self._assignments.values())
+        for slot in range(self.n_slots):
+            if slot not in taken:
+                return slot
+        
+        # Steal from the least recently used idle conversation, else the least busy slot
+        victim = next((c for c, s in self._assignments.items() if self._in_flight[s] == 0), None)
+        if victim is None:
+            victim = min(self._assignments, key=lambda c: self._in_flight[self._assignments[c]])
+        self.reassignments += 1
+        return self._assignments.pop(victim)
+    
+    def release(self, slot: Optional[int]):
+        """Mark a request on the slot as finished"""
+        if slot is not None:
+            self._in_flight[slot] -= 1
+    
+    def forget(self, conv_id: str):
+        """Drop the assignment of a deleted conversation"""
+        self._assignments.pop(conv_id, None)
+    
+    def record_timings(self, timings: Optional[Dict[str, Any]]):
+        """Account llama-server prompt timings (cache_n reused, prompt_n evaluated)"""
+        if not timings:
+            return
+        cached = int(timings.get("cache_n") or 0)
+        self.cached_tokens += cached
+        self.prompt_tokens += cached + int(timings.get("prompt_n") or 0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Slot assignment and prefix-cache hit statistics"""
+        return {
+            "slots": self.n_slots,
+            "assigned": len(self._assignments),
+            "reassignments": self.reassignments,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        }
@@ -1,38 +1,115 @@
+import asyncio
 import json
-import requests
-from ddgs import DDGS
-from bs4 import BeautifulSoup
+import threading
+from ..core.config import settings
+from .html_text import extract_text
+
+# Content types the open action can turn into text
+TEXT_CONTENT_TYPES = ("text/", "application/xhtml+xml", "application/xml", "application/json")
 
 class BrowserTool:
-    @property
-    def definition(self):
-        return {
-            "type": "function",
-            "function": {
-                "name": "browser",
-                "description": "Search or fetch web pages.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "action": {"type": "string", "enum": ["search", "open"]},
-                        "query": {"type": "string"},
-                        "url": {"type": "string", "format": "uri"},
-                        "limit": {"type": "integer", "default": 5}
-                    },
-                    "required": ["action"]
-                }
+    definition = {
+        "type": "function",
+        "function": {
+            "name": "browser",
+            "description": "Search or fetch web pages. Long pages are returned in pages of text; use offset to read further.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": ["search", "open"]},
+                    "query": {"type": "string"},
+                    "url": {"type": "string", "format": "uri"},
+                    "limit": {"type": "integer", "default": 5},
+                    "offset": {"type": "integer", "default": 0},
+                    "max_chars": {"type": "integer", "default": settings.BROWSER_OPEN_MAX_CHARS}
+                },
+                "required": ["action"]
             }
         }
+    }
+    
+    def __init__(self, jupyter_service=None):
+        # requests and ddgs are imported here, on first use, not with the definition
+        from .http_cache import ResponseCache, TTLCache, shared_session
+        self.session = shared_session(settings.BROWSER_POOL_SIZE)
+        self.page_cache = ResponseCache(
+            settings.BROWSER_CACHE_DIR,
+            max_bytes=settings.BROWSER_CACHE_MAX_BYTES,
+            ttl=settings.BROWSER_CACHE_TTL
+        )
+        self.search_cache = TTLCache(settings.BROWSER_SEARCH_CACHE_SIZE, settings.BROWSER_SEARCH_CACHE_TTL)
+        # url -> (extracted text, whether extraction reached the end of the page)
+        self.text_cache = TTLCache(settings.BROWSER_TEXT_CACHE_SIZE, settings.BROWSER_CACHE_TTL)
+        self._local = threading.local()
+    
+    async def execute(self, conv_id: str, args: dict) -> str:
+        # DDGS and requests are blocking; keep them off the event loop
+        return await asyncio.to_thread(self._execute, args)
+    
+    def _ddgs(self):
+        """Per-thread DDGS client, reused so its connections stay open"""
+        ddg = getattr(self._local, "ddgs", None)
+        if ddg is None:
+            from ddgs import DDGS
+            ddg = self._local.ddgs = DDGS()
+        return ddg
     
-    def execute(self, conv_id: str, args: dict) -> str:
+    def _execute(self, args: dict) -> str:
+        from .http_cache import UnsupportedContentType, normalize_query
         if args["action"] == "search":
-            with DDGS() as ddg:
-                res = ddg.text(args.get("query", ""), max_results=int(args.get("limit", 5)))
-            return json.dumps(res[:int(args.get("limit", 5))])
+            limit = int(args.get("limit", 5))
+            key = (normalize_query(args.get("query", "")), limit)
+            cached = self.search_cache.get(key)
+            if cached is not None:
+                return cached
+            res = self._ddgs().text(args.get("query", ""), max_results=limit)
+            result = json.dumps(res[:limit])
+            self.search_cache.put(key, result)
+            return result
         
         elif args["action"] == "open":
-            r = requests.get(args["url"], timeout=15)
-            r.raise_for_status()
-            return BeautifulSoup(r.text, "html.parser").get_text(" ", strip=True)[:2000]
+            offset = max(int(args.get("offset", 0)), 0)
+            max_chars = min(max(int(args.get("max_chars", settings.BROWSER_OPEN_MAX_CHARS)), 1), 20000)
+            try:
+                text, complete = self._page_text(args["url"], offset + max_chars)
+            except UnsupportedContentType as e:
+                return str(e)
+            
+            if complete and offset >= len(text) > 0:
+                return f"[offset {offset} is past the end of the page ({len(text)} characters)]"
+            
+            page = text[offset:offset + max_chars]
+            end = offset + len(page)
+            if end < len(text) or not complete:
+                page += f"\n[characters {offset}-{end}; more available, call open with offset={end}]"
+            elif offset:
+                page += f"\n[characters {offset}-{end} of {len(text)}; end of page]"
+            return page
         
-        return "unknown browser action"
\ No newline at end of file
+        return "unknown browser action"
+    
+    def _page_text(self, url: str, needed: int):
+        """Readable text of a page, extracting at least needed characters if the page has them"""
+        cached = self.text_cache.get(url)
+        if cached is not None and (cached[1] or len(cached[0]) >= needed):
+            return cached
+        
+        meta, body = self.page_cache.get(
+            self.session, url, timeout=15,
+            max_bytes=settings.BROWSER_MAX_BYTES, content_types=TEXT_CONTENT_TYPES
+        )
+        is_html = "html" in meta.get("content_type", "").lower()
+        # Extract ahead of what is needed so the next page is usually served from cache
+        text, complete = extract_text(body, meta.get("encoding"), max(needed * 2, 8000), is_html=is_html)
+        if complete and meta.get("truncated"):
+            text += f" [page cut off after {len(body)} bytes]"
+        self.text_cache.put(url, (text, complete))
+        return text, complete
+    
+    def get_stats(self) -> dict:
+        """Page, text and search cache statistics"""
+        return {
+            "pages": self.page_cache.get_stats(),
+            "texts": self.text_cache.get_stats(),
+            "searches": self.search_cache.get_stats()
+        }
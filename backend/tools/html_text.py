@@ -0,0 +1,74 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import List, Tuple
+
+# Elements whose contents are never readable text
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "object"}
+# Elements that separate blocks of text
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "pre", "table"}
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML-to-text converter that skips non-readable elements"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._length = 0
+        self._skip_depth = 0
+    
+    @property
+    def length(self) -> int:
+        return self._length
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._append(" ")
+    
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._append(" ")
+    
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._append(" ")
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._append(data)
+    
+    def _append(self, text: str):
+        text = re.sub(r"\s+", " ", text)
+        if not text or (text == " " and (not self._parts or self._parts[-1].endswith(" "))):
+            return
+        self._parts.append(text)
+        self._length += len(text)
+    
+    def text(self) -> str:
+        return re.sub(r"\s+", " ", "".join(self._parts)).strip()
+
+def extract_text(body: bytes, encoding: str, limit: int, is_html: bool = True,
+                 chunk_size: int = 64 * 1024) -> Tuple[str, bool]:
+    """Extract readable text from a page body, stopping once limit characters are collected.
+    
+    Returns (text, complete) where complete is False if extraction stopped early.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    if not is_html:
+        return decoder.decode(body, final=True), True
+    
+    parser = TextExtractor()
+    for start in range(0, len(body), chunk_size):
+        final = start + chunk_size >= len(body)
+        parser.feed(decoder.decode(body[start:start + chunk_size], final=final))
+        if parser.length >= limit and not final:
+            return parser.text()[:limit], False
+    parser.close()
+    return parser.text(), True
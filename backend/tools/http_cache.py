@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def shared_session(pool_size: int = 16) -> requests.Session:
+    """Process-wide requests session with keep-alive connection pooling"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "Mozilla/5.0 (compatible; LocalGPT/1.0)"
+            _session = session
+        return _session
+
+def normalize_query(query: str) -> str:
+    """Normalise a search query so trivially different spellings share a cache entry"""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry expiry and LRU eviction"""
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+class UnsupportedContentType(Exception):
+    """Raised when a fetched resource is not a type the caller can read"""
+
+class ResponseCache:
+    """On-disk HTTP response cache honouring ETag, Last-Modified and a TTL.
+    
+    Fresh entries are served without touching the network; stale ones are
+    revalidated with a conditional GET. Total size is capped by evicting the
+    least recently used entries.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # key -> body size, LRU order
+        self._size = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        
+        os.makedirs(directory, exist_ok=True)
+        bodies = [f for f in os.listdir(directory) if f.endswith(".body")]
+        for name in sorted(bodies, key=lambda f: os.path.getmtime(os.path.join(directory, f))):
+            key = name[:-len(".body")]
+            size = os.path.getsize(os.path.join(directory, name))
+            self._index[key] = size
+            self._size += size
+    
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+    
+    def _load(self, key: str) -> Optional[Tuple[Dict, bytes]]:
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+    
+    def _store(self, key: str, meta: Dict, body: bytes):
+        meta_path, body_path = self._paths(key)
+        tmp = f".{threading.get_ident()}.tmp"
+        with open(body_path + tmp, "wb") as f:
+            f.write(body)
+        with open(meta_path + tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(body_path + tmp, body_path)
+        os.replace(meta_path + tmp, meta_path)
+        with self._lock:
+            self._size += len(body) - self._index.pop(key, 0)
+            self._index[key] = len(body)
+            self._evict()
+    
+    def _touch(self, key: str):
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+    
+    def _evict(self):
+        """Remove least recently used entries over the size cap; caller holds the lock"""
+        while self._size > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def get(self, session: requests.Session, url: str, timeout: float = 15, max_bytes: Optional[int] = None,
+            content_types: Optional[Tuple[str, ...]] = None) -> Tuple[Dict, bytes]:
+        """Fetch url through the cache, returning (meta, body).
+        
+        The body is streamed and cut off after max_bytes (meta["truncated"] is set).
+        Responses whose Content-Type does not start with one of content_types are
+        rejected with UnsupportedContentType before their body is downloaded.
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()
+        cached = self._load(key) if key in self._index else None
+        
+        headers = {}
+        if cached is not None:
+            meta, body = cached
+            if time.time() - meta["stored_at"] < self.ttl:
+                self.hits += 1
+                self._touch(key)
+                return meta, body
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        
+        with session.get(url, headers=headers, timeout=timeout, stream=True) as r:
+            if cached is not None and r.status_code == 304:
+                self.revalidated += 1
+                meta, body = cached
+                meta["stored_at"] = time.time()
+                self._store(key, meta, body)
+                return meta, body
+            
+            r.raise_for_status()
+            content_type = r.headers.get("Content-Type", "")
+            if content_types and not content_type.lower().startswith(content_types):
+                raise UnsupportedContentType(f"Unsupported content type: {content_type or 'unknown'}")
+            
+            self.misses += 1
+            body, truncated = self._read(r, max_bytes)
+            meta = {
+                "url": url,
+                "stored_at": time.time(),
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "content_type": content_type,
+                "encoding": r.encoding,
+                "truncated": truncated
+            }
+        
+        if "no-store" not in r.headers.get("Cache-Control", ""):
+            self._store(key, meta, body)
+        return meta, body
+    
+    @staticmethod
+    def _read(r: requests.Response, max_bytes: Optional[int]) -> Tuple[bytes, bool]:
+        """Read a streamed body, stopping after max_bytes"""
+        chunks, size = [], 0
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if max_bytes is not None and size >= max_bytes:
+                return b"".join(chunks)[:max_bytes], True
+        return b"".join(chunks), False
+    
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.revalidated + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self._size,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.revalidated) / total if total else 0.0
+        }
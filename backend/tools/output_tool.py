@@ -0,0 +1,38 @@
+import asyncio
+from ..core.config import settings
+from ..services.jupyter_service import JupyterService
+from ..services.output_capture import OutputStore
+
+class OutputTool:
+    definition = {
+        "type": "function",
+        "function": {
+            "name": "output",
+            "description": "Read the full text of a long python output that was shortened, by its handle (out-...). Use offset to read further.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "handle": {"type": "string"},
+                    "offset": {"type": "integer", "default": 0},
+                    "max_chars": {"type": "integer", "default": settings.TOOL_OUTPUT_PAGE_CHARS}
+                },
+                "required": ["handle"]
+            }
+        }
+    }
+    
+    def __init__(self, jupyter_service: JupyterService):
+        self.output_store: OutputStore = jupyter_service.output_store
+    
+    async def execute(self, conv_id: str, args: dict) -> str:
+        offset = max(int(args.get("offset", 0)), 0)
+        max_chars = min(max(int(args.get("max_chars", settings.TOOL_OUTPUT_PAGE_CHARS)), 1), 20000)
+        page = await asyncio.to_thread(self.output_store.read, conv_id, str(args.get("handle", "")), offset, max_chars)
+        if page is None:
+            return f"[no output {args.get('handle')!r} in this conversation]"
+        text, end, size = page
+        if offset >= size:
+            return f"[offset {offset} is past the end of the output ({size} bytes)]"
+        if end < size:
+            return text + f"\n[bytes {offset}-{end} of {size}; more available, call output with offset={end}]"
+        return text + f"\n[bytes {offset}-{end} of {size}; end of output]"
@@ -1,25 +1,35 @@
-from ..services.jupyter_service import JupyterService
+from typing import Optional
+from ..services.jupyter_service import JupyterService, OutputCallback
 
 class PythonTool:
-    def __init__(self, jupyter_service: JupyterService):
-        self.jupyter_service = jupyter_service
+    # Calls share one kernel per conversation and must run in order
+    stateful = True
+    # Output is reported incrementally through on_output
+    streams_output = True
     
-    @property
-    def definition(self):
-        return {
-            "type": "function",
-            "function": {
-                "name": "python",
-                "description": "Execute Python code in a stateful Jupyter kernel. Use %pip to install packages.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "code": {"type": "string"}
-                    },
-                    "required": ["code"]
-                }
+    definition = {
+        "type": "function",
+        "function": {
+            "name": "python",
+            "description": "Execute Python code in a stateful Jupyter kernel. Use %pip to install packages.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "code": {"type": "string"}
+                },
+                "required": ["code"]
             }
         }
+    }
+    # Long outputs are paged through the output tool
+    companions = ("output",)
+    
+    def __init__(self, jupyter_service: JupyterService):
+        self.jupyter_service = jupyter_service
+    
+    async def prepare(self, conv_id: str):
+        """Start the kernel while the model is still writing the code"""
+        await self.jupyter_service.prepare_kernel(conv_id)
     
-    def execute(self, conv_id: str, args: dict) -> str:
-        return self.jupyter_service.execute_python(conv_id, args["code"])
\ No newline at end of file
+    async def execute(self, conv_id: str, args: dict, on_output: Optional[OutputCallback] = None) -> str:
+        return await self.jupyter_service.execute_python(conv_id, args["code"], on_output=on_output)
\ No newline at end of file
@@ -1,34 +1,190 @@
+import asyncio
+import importlib
 import json
-from typing import Dict, List, Any
-from .python_tool import PythonTool
-from .browser_tool import BrowserTool
+import time
+import weakref
+from collections import OrderedDict
+from importlib.metadata import entry_points
+from typing import Callable, Dict, List, Any, Optional, Sequence, Set, Tuple
 from ..services.jupyter_service import JupyterService
+from ..core.config import settings
+from ..core.metrics import Histogram
+
+TOOL_SECONDS = Histogram("localgpt_tool_seconds", "Tool call latency, including queueing for the tool", ["tool"])
+
+# Built-in tools as name -> "module:Class"; TOOL_PLUGINS and the entry points
+# of ENTRY_POINT_GROUP add to (or replace) them
+BUILTIN_TOOLS = {
+    "python": f"{__package__}.python_tool:PythonTool",
+    "browser": f"{__package__}.browser_tool:BrowserTool",
+    "output": f"{__package__}.output_tool:OutputTool",
+}
+ENTRY_POINT_GROUP = "localgpt.tools"
 
 class ToolRegistry:
+    """Tools by name, each imported and constructed only when first needed.
+    
+    A tool class has a class-level OpenAI-style ``definition`` and is
+    constructed with the JupyterService. Optional attributes: ``stateful``,
+    ``streams_output``, ``companions`` (tools enabled along with it) and the
+    methods ``prepare``, ``forget`` and ``get_stats``.
+    
+    Conversations use the TOOLS setting (all tools if empty) unless enable()
+    gave them their own set; smaller sets keep the tool schema in the prompt small.
+    Like other per-conversation state, own sets are kept for the
+    CONVERSATION_CACHE_SIZE most recently used conversations.
+    """
+    
     def __init__(self, jupyter_service: JupyterService):
-        self.tools = {
-            "python": PythonTool(jupyter_service),
-            "browser": BrowserTool()
-        }
-    
-    def get_tool_definitions(self) -> List[Dict[str, Any]]:
-        """Get OpenAI-compatible tool definitions"""
-        return [tool.definition for tool in self.tools.values()]
-    
-    def execute_tool(self, name: str, args: dict, conv_id: str) -> str:
-        """Execute a tool by name"""
-        if name not in self.tools:
+        self.jupyter_service = jupyter_service
+        self._targets = dict(BUILTIN_TOOLS)
+        for ep in entry_points(group=ENTRY_POINT_GROUP):
+            self._targets[ep.name] = ep.value
+        self._targets.update(settings.TOOL_PLUGINS)
+        self._classes: Dict[str, type] = {}
+        self.tools: Dict[str, Any] = {}  # constructed so far
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._latency: Dict[str, Any] = {}
+        unknown = [name for name in settings.TOOLS if name not in self._targets]
+        if unknown:
+            raise ValueError(f"Unknown tools in TOOLS: {', '.join(unknown)}")
+        self._default: Optional[Tuple[str, ...]] = None  # expanded on first use
+        # conv_id -> its own tool set, for the CONVERSATION_CACHE_SIZE most recently used
+        self._enabled: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        # Per tool set: definitions handed to every completion, and their JSON
+        self._definitions: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        self._definitions_json: Dict[Tuple[str, ...], str] = {}
+        # Held only while in use, so finished conversations don't accumulate locks
+        self._conversation_locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._preparing: Set[asyncio.Task] = set()  # referenced until done, as nobody awaits them
+    
+    def _class(self, name: str) -> type:
+        """Import a tool's class"""
+        cls = self._classes.get(name)
+        if cls is None:
+            module, _, attr = self._targets[name].partition(":")
+            cls = self._classes[name] = getattr(importlib.import_module(module), attr)
+        return cls
+    
+    def _tool(self, name: str) -> Any:
+        """Construct a tool on first use"""
+        tool = self.tools.get(name)
+        if tool is None:
+            tool = self.tools[name] = self._class(name)(self.jupyter_service)
+            self._semaphores[name] = asyncio.Semaphore(
+                settings.TOOL_CONCURRENCY.get(name, settings.TOOL_MAX_CONCURRENCY)
+            )
+            self._latency[name] = TOOL_SECONDS.labels(name)
+        return tool
+    
+    def _conversation_lock(self, name: str, conv_id: str) -> asyncio.Lock:
+        """Lock serialising calls of a stateful tool within one conversation"""
+        key = (name, conv_id)
+        lock = self._conversation_locks.get(key)
+        if lock is None:
+            lock = self._conversation_locks[key] = asyncio.Lock()
+        return lock
+    
+    def _expand(self, names: Sequence[str]) -> Tuple[str, ...]:
+        """Names without duplicates, plus the companions of each tool"""
+        expanded = list(dict.fromkeys(names))
+        for name in list(expanded):
+            expanded += [c for c in getattr(self._class(name), "companions", ()) if c not in expanded]
+        return tuple(expanded)
+    
+    def enable(self, conv_id: str, names: Sequence[str]):
+        """Give a conversation its own tool set; raises ValueError for unknown tools"""
+        unknown = [name for name in names if name not in self._targets]
+        if unknown:
+            raise ValueError(f"Unknown tools: {', '.join(unknown)}")
+        self._enabled[conv_id] = self._expand(names)
+        self._enabled.move_to_end(conv_id)
+        if len(self._enabled) > settings.CONVERSATION_CACHE_SIZE:
+            self._enabled.popitem(last=False)
+    
+    def enabled_tools(self, conv_id: Optional[str] = None) -> Tuple[str, ...]:
+        """The conversation's tools, or the default set"""
+        enabled = self._enabled.get(conv_id)
+        if enabled is not None:
+            self._enabled.move_to_end(conv_id)
+            return enabled
+        if self._default is None:
+            self._default = self._expand(settings.TOOLS or list(self._targets))
+        return self._default
+    
+    def get_tool_definitions(self, conv_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get OpenAI-compatible tool definitions of the conversation's tools.
+        
+        Built once per tool set; callers must not modify the list.
+        """
+        names = self.enabled_tools(conv_id)
+        definitions = self._definitions.get(names)
+        if definitions is None:
+            definitions = self._definitions[names] = [self._class(name).definition for name in names]
+        return definitions
+    
+    def get_tool_definitions_json(self, conv_id: Optional[str] = None) -> str:
+        """The conversation's tool definitions, serialized once per tool set"""
+        names = self.enabled_tools(conv_id)
+        encoded = self._definitions_json.get(names)
+        if encoded is None:
+            encoded = self._definitions_json[names] = json.dumps(self.get_tool_definitions(conv_id))
+        return encoded
+    
+    def prepare(self, name: str, conv_id: str) -> Optional[asyncio.Task]:
+        """Start a tool's preparation for a call that is still being generated.
+        
+        Failures are left for the call itself to report. The task runs to the
+        end even if the call never comes: cancelled halfway, it could leave a
+        resource it was acquiring (e.g. a kernel) half set up, while a finished
+        one is released like any other once idle.
+        """
+        if name not in self.enabled_tools(conv_id) or not hasattr(self._class(name), "prepare"):
+            return None
+        task = asyncio.create_task(self._tool(name).prepare(conv_id))
+        self._preparing.add(task)
+        task.add_done_callback(self._preparing.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+    
+    async def execute_tool(self, name: str, args: dict, conv_id: str,
+                           on_output: Optional[Callable[[str, str], None]] = None) -> str:
+        """Execute a tool by name, forwarding incremental output to on_output if the tool streams"""
+        if name not in self.enabled_tools(conv_id):
             return f"Unknown tool: {name}"
         
+        started = time.perf_counter()
         try:
-            tool = self.tools[name]
+            tool = self._tool(name)
             if not hasattr(tool, 'execute'):
                 return f"Tool {name} does not have execute method. Has: {dir(tool)}"
-            return tool.execute(conv_id, args)
+            kwargs = {"on_output": on_output} if on_output and getattr(tool, "streams_output", False) else {}
+            if getattr(tool, "stateful", False):
+                # Take the per-conversation lock first so calls keep their submission order
+                lock = self._conversation_lock(name, conv_id)
+                async with lock:
+                    async with self._semaphores[name]:
+                        return await tool.execute(conv_id, args, **kwargs)
+            async with self._semaphores[name]:
+                return await tool.execute(conv_id, args, **kwargs)
         except Exception as e:
             import traceback
             return f"Tool execution error: {str(e)}\nTraceback: {traceback.format_exc()}"
+        finally:
+            if name in self._latency:
+                self._latency[name].observe(time.perf_counter() - started)
+    
+    def forget(self, conv_id: str):
+        """Drop what tools keep for a deleted conversation"""
+        self._enabled.pop(conv_id, None)
+        for tool in self.tools.values():
+            if hasattr(tool, "forget"):
+                tool.forget(conv_id)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get statistics reported by tools that keep any"""
+        return {name: tool.get_stats() for name, tool in self.tools.items() if hasattr(tool, "get_stats")}
     
     def get_available_tools(self) -> List[str]:
         """Get list of available tool names"""
-        return list(self.tools.keys())
\ No newline at end of file
+        return list(self._targets)
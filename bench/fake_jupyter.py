@@ -0,0 +1,136 @@
+"""Fake Jupyter gateway for benchmarks.
+
+Implements the kernel REST endpoints and the channels websocket closely
+enough for the orchestrator: execute_request is answered with busy status,
+stdout stream chunks, an execute_reply and idle status after a simulated
+execution time. Code is never run.
+"""
+import asyncio
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+
+@dataclass
+class FakeJupyterConfig:
+    kernel_start: float = 0.5   # seconds to start a kernel
+    exec_time: float = 0.05     # seconds per execution
+    output_chunks: int = 1      # stdout stream messages per execution
+    output_bytes: int = 32      # size of each stdout chunk
+
+@dataclass
+class FakeJupyterStats:
+    kernels_created: int = 0
+    kernels_deleted: int = 0
+    max_kernels: int = 0
+    executions: int = 0
+    interrupts: int = 0
+    ws_connects: int = 0
+
+def create_fake_jupyter(config: FakeJupyterConfig) -> FastAPI:
+    app = FastAPI()
+    stats = FakeJupyterStats()
+    app.state.stats = stats
+    kernels: Dict[str, Dict[str, Any]] = {}
+    
+    @app.post("/api/kernels")
+    async def create_kernel():
+        await asyncio.sleep(config.kernel_start)
+        kernel_id = str(uuid.uuid4())
+        kernels[kernel_id] = {"id": kernel_id, "name": "python3", "execution_count": 0, "running": None}
+        stats.kernels_created += 1
+        stats.max_kernels = max(stats.max_kernels, len(kernels))
+        return {"id": kernel_id, "name": "python3"}
+    
+    @app.get("/api/kernels")
+    async def list_kernels():
+        return [{"id": k["id"], "name": k["name"]} for k in kernels.values()]
+    
+    @app.get("/api/kernels/{kernel_id}")
+    async def get_kernel(kernel_id: str):
+        if kernel_id not in kernels:
+            raise HTTPException(status_code=404, detail="Kernel not found")
+        return {"id": kernel_id, "name": "python3"}
+    
+    @app.delete("/api/kernels/{kernel_id}", status_code=204)
+    async def delete_kernel(kernel_id: str):
+        if kernels.pop(kernel_id, None) is None:
+            raise HTTPException(status_code=404, detail="Kernel not found")
+        stats.kernels_deleted += 1
+    
+    @app.post("/api/kernels/{kernel_id}/interrupt", status_code=204)
+    async def interrupt_kernel(kernel_id: str):
+        kernel = kernels.get(kernel_id)
+        if kernel is None:
+            raise HTTPException(status_code=404, detail="Kernel not found")
+        stats.interrupts += 1
+        if kernel["running"] is not None:
+            kernel["running"].cancel()
+    
+    @app.websocket("/api/kernels/{kernel_id}/channels")
+    async def channels(ws: WebSocket, kernel_id: str):
+        kernel = kernels.get(kernel_id)
+        if kernel is None:
+            await ws.close(code=1008)
+            return
+        await ws.accept()
+        stats.ws_connects += 1
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        def message(parent: Dict, msg_type: str, content: Dict, channel: str = "iopub") -> str:
+            header = {"msg_id": uuid.uuid4().hex, "msg_type": msg_type, "session": parent.get("session", ""),
+                      "username": "fake", "version": "5.3"}
+            return json.dumps({"header": header, "parent_header": parent, "metadata": {}, "content": content,
+                               "msg_type": msg_type, "channel": channel})
+        
+        async def execute(parent: Dict):
+            kernel["execution_count"] += 1
+            count = kernel["execution_count"]
+            status = "ok"
+            await ws.send_text(message(parent, "status", {"execution_state": "busy"}))
+            try:
+                step = config.exec_time / max(config.output_chunks, 1)
+                for _ in range(config.output_chunks):
+                    await asyncio.sleep(step)
+                    text = ("x" * (config.output_bytes - 1)) + "\n"
+                    await ws.send_text(message(parent, "stream", {"name": "stdout", "text": text}))
+                if not config.output_chunks:
+                    await asyncio.sleep(config.exec_time)
+            except asyncio.CancelledError:
+                status = "error"
+                await ws.send_text(message(parent, "error", {
+                    "ename": "KeyboardInterrupt", "evalue": "", "traceback": ["KeyboardInterrupt"]
+                }))
+            await ws.send_text(message(parent, "execute_reply", {"status": status, "execution_count": count}, "shell"))
+            await ws.send_text(message(parent, "status", {"execution_state": "idle"}))
+        
+        async def worker():
+            # Like a real kernel, executions run one at a time in arrival order
+            while True:
+                parent = await queue.get()
+                stats.executions += 1
+                kernel["running"] = asyncio.create_task(execute(parent))
+                try:
+                    await kernel["running"]
+                except (WebSocketDisconnect, RuntimeError):
+                    return  # client went away mid-execution
+                finally:
+                    kernel["running"] = None
+        
+        runner = asyncio.create_task(worker())
+        try:
+            while True:
+                msg = json.loads(await ws.receive_text())
+                if msg.get("header", {}).get("msg_type") == "execute_request":
+                    queue.put_nowait(msg["header"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            runner.cancel()
+    
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats.__dict__, "live_kernels": len(kernels)}
+    
+    return app
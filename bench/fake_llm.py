@@ -0,0 +1,187 @@
+"""Fake OpenAI-compatible chat completions server for benchmarks.
+
+Streams a fixed number of tokens after a configurable time to first token,
+optionally answers with a python tool call, and mimics llama-server's slot
+handling: id_slot pins a request to a slot, the slot remembers its last
+prompt, and the reply carries timings with cache_n/prompt_n.
+"""
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+@dataclass
+class FakeLLMConfig:
+    ttft: float = 0.05              # seconds before the first token
+    tokens_per_second: float = 200  # decode speed, 0 streams as fast as possible
+    tokens: int = 64                # tokens per answer
+    tool_every: int = 0             # every Nth user turn answers with a python tool call, 0 never
+    tool_code: str = "print(sum(range(10)))"
+    tool_argument_chunks: int = 1   # pieces the streamed arguments arrive in, one per token
+    slots: int = 4                  # concurrent requests served, like llama-server --parallel
+    prefill_tokens_per_second: float = 0  # charge uncached prompt tokens to the TTFT, 0 disables
+
+@dataclass
+class FakeLLMStats:
+    requests: int = 0
+    streamed: int = 0
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    max_waiting: int = 0
+    slot_prompts: Dict[int, str] = field(default_factory=dict)
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+def create_fake_llm(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI()
+    stats = FakeLLMStats()
+    app.state.stats = stats
+    slots = asyncio.Semaphore(config.slots) if config.slots > 0 else None
+    waiting = 0
+    
+    def prompt_timings(body: Dict[str, Any]) -> Dict[str, int]:
+        """Prompt tokens reused from the slot's previous prompt vs evaluated now"""
+        prompt = json.dumps(body.get("messages", []))
+        slot = body.get("id_slot")
+        cached = 0
+        if slot is not None:
+            previous = stats.slot_prompts.get(slot, "")
+            common = 0
+            for a, b in zip(previous, prompt):
+                if a != b:
+                    break
+                common += 1
+            cached = _estimate_tokens(prompt[:common])
+            stats.slot_prompts[slot] = prompt
+        total = _estimate_tokens(prompt)
+        stats.prompt_tokens += total
+        stats.cached_tokens += cached
+        return {"cache_n": cached, "prompt_n": total - cached}
+    
+    def wants_tool(body: Dict[str, Any]) -> bool:
+        messages = body.get("messages", [])
+        if not config.tool_every or body.get("tool_choice") == "none" or not body.get("tools"):
+            return False
+        if not messages or messages[-1].get("role") != "user":
+            return False
+        return stats.requests % config.tool_every == 0
+    
+    def tool_call() -> Dict[str, Any]:
+        return {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": "python", "arguments": json.dumps({"code": config.tool_code})}
+        }
+    
+    async def first_token_delay(timings: Dict[str, int]):
+        delay = config.ttft
+        if config.prefill_tokens_per_second > 0:
+            delay += timings["prompt_n"] / config.prefill_tokens_per_second
+        await asyncio.sleep(delay)
+    
+    async def token_delay():
+        if config.tokens_per_second > 0:
+            await asyncio.sleep(1 / config.tokens_per_second)
+    
+    async def acquire():
+        nonlocal waiting
+        if slots is None:
+            return
+        waiting += 1
+        stats.max_waiting = max(stats.max_waiting, waiting)
+        try:
+            await slots.acquire()
+        finally:
+            waiting -= 1
+    
+    def release():
+        if slots is not None:
+            slots.release()
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        use_tool = wants_tool(body)
+        if use_tool:
+            stats.tool_calls += 1
+        cid = f"chatcmpl-{uuid.uuid4().hex}"
+        usage_completion = 0 if use_tool else config.tokens
+        
+        def event(**fields) -> str:
+            payload = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake", **fields}
+            return f"data: {json.dumps(payload)}\n\n"
+        
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None, **extra) -> str:
+            return event(choices=[{"index": 0, "delta": delta, "finish_reason": finish}], **extra)
+        
+        if not body.get("stream"):
+            await acquire()
+            try:
+                timings = prompt_timings(body)
+                await first_token_delay(timings)
+                if use_tool:
+                    message = {"role": "assistant", "content": None, "tool_calls": [tool_call()]}
+                else:
+                    for _ in range(config.tokens):
+                        await token_delay()
+                    message = {"role": "assistant", "content": "tok " * config.tokens}
+            finally:
+                release()
+            return JSONResponse({
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if use_tool else "stop"}],
+                "usage": {"prompt_tokens": timings["prompt_n"] + timings["cache_n"], "completion_tokens": usage_completion,
+                          "total_tokens": timings["prompt_n"] + timings["cache_n"] + usage_completion},
+                "timings": timings
+            })
+        
+        async def stream():
+            await acquire()
+            try:
+                stats.streamed += 1
+                timings = prompt_timings(body)
+                await first_token_delay(timings)
+                if use_tool:
+                    call = tool_call()
+                    arguments = call["function"].pop("arguments")
+                    call["function"]["arguments"] = ""
+                    yield chunk({"role": "assistant", "tool_calls": [{"index": 0, **call}]})
+                    size = -(-len(arguments) // max(config.tool_argument_chunks, 1))
+                    for start in range(0, len(arguments), size):
+                        yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": arguments[start:start + size]}}]})
+                        await token_delay()
+                else:
+                    for _ in range(config.tokens):
+                        yield chunk({"content": "tok "})
+                        await token_delay()
+                yield chunk({}, "tool_calls" if use_tool else "stop", timings=timings)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    prompt = timings["prompt_n"] + timings["cache_n"]
+                    usage = {"prompt_tokens": prompt, "completion_tokens": usage_completion,
+                             "total_tokens": prompt + usage_completion}
+                    yield event(choices=[], usage=usage)
+                yield "data: [DONE]\n\n"
+            finally:
+                release()
+        
+        return StreamingResponse(stream(), media_type="text/event-stream")
+    
+    @app.get("/stats")
+    async def get_stats():
+        return {
+            "requests": stats.requests,
+            "streamed": stats.streamed,
+            "tool_calls": stats.tool_calls,
+            "prompt_tokens": stats.prompt_tokens,
+            "cached_tokens": stats.cached_tokens,
+            "max_waiting": stats.max_waiting
+        }
+    
+    return app
@@ -0,0 +1,301 @@
+"""Load generator for the orchestrator.
+
+Starts the fake LLM and fake Jupyter gateway in-process, runs the orchestrator
+as a subprocess pointed at them, drives /api/chat and /api/chat/stream at a
+fixed concurrency and writes latency, throughput and orchestrator CPU/RSS as
+JSON so runs can be compared between commits:
+
+    python -m bench.loadgen --requests 500 --concurrency 32 --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+import uvicorn
+from .fake_jupyter import FakeJupyterConfig, create_fake_jupyter
+from .fake_llm import FakeLLMConfig, create_fake_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Run an ASGI app on its own event loop in a daemon thread"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 (nearest rank), mean and max of values"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+    rank = lambda q: ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+    return {
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1]
+    }
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process from /proc"""
+    
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.rss: List[int] = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._start_cpu = 0.0
+        self._start_time = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks  # utime + stime
+    
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+    
+    async def _run(self):
+        while True:
+            self.rss.append(self.rss_bytes())
+            await asyncio.sleep(self.interval)
+    
+    def start(self):
+        self._start_cpu = self.cpu_seconds()
+        self._start_time = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+    
+    def stop(self) -> Dict[str, Any]:
+        self._task.cancel()
+        cpu = self.cpu_seconds() - self._start_cpu
+        wall = time.monotonic() - self._start_time
+        self.rss.append(self.rss_bytes())
+        return {
+            "cpu_seconds": cpu,
+            "cpu_percent": 100 * cpu / wall if wall else 0.0,
+            "rss_peak_mb": max(self.rss) / 2 ** 20,
+            "rss_mean_mb": sum(self.rss) / len(self.rss) / 2 ** 20
+        }
+
+class Result:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.status = 0
+        self.ttft: Optional[float] = None
+        self.latency = 0.0
+        self.events = 0
+        self.error: Optional[str] = None
+
+async def run_stream(client: httpx.AsyncClient, conv_id: str, message: str) -> Result:
+    result = Result("stream")
+    started = time.perf_counter()
+    async with client.stream("POST", "/api/chat/stream", json={"message": message, "conversation_id": conv_id}) as r:
+        result.status = r.status_code
+        if r.status_code != 200:
+            await r.aread()
+            result.error = f"HTTP {r.status_code}"
+            return result
+        async for line in r.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            result.events += 1
+            if result.ttft is None and event["type"] in ("content", "tool_start"):
+                result.ttft = time.perf_counter() - started
+            if event["type"] == "error":
+                result.error = event.get("error", "error")
+    result.latency = time.perf_counter() - started
+    return result
+
+async def run_sync(client: httpx.AsyncClient, conv_id: str, message: str) -> Result:
+    result = Result("sync")
+    started = time.perf_counter()
+    r = await client.post("/api/chat", json={"message": message, "conversation_id": conv_id})
+    result.latency = time.perf_counter() - started
+    result.status = r.status_code
+    result.events = 1
+    if r.status_code != 200:
+        result.error = f"HTTP {r.status_code}"
+    return result
+
+async def drive(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Send args.requests turns with args.concurrency in flight, return the results"""
+    results: List[Result] = []
+    remaining = args.requests
+    rng = random.Random(args.seed)
+    conversations = [f"bench-{i}" for i in range(args.conversations)] if args.conversations else None
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                n = args.requests - remaining
+                conv_id = rng.choice(conversations) if conversations else f"bench-{n}-{rng.getrandbits(32):08x}"
+                run = run_stream if rng.random() < args.stream_ratio else run_sync
+                try:
+                    results.append(await run(client, conv_id, f"request {n}: {args.message}"))
+                except Exception as e:
+                    failed = Result(run.__name__[len("run_"):])
+                    failed.error = repr(e)
+                    results.append(failed)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        health = (await client.get("/api/health")).json()
+    
+    ok = [r for r in results if r.error is None]
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "ok": len(ok),
+        "rejected": sum(1 for r in results if r.status == 429),
+        "errors": sum(1 for r in results if r.error is not None and r.status != 429),
+        "error_samples": sorted({r.error for r in results if r.error})[:5],
+        "turns_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "events_per_second": sum(r.events for r in ok) / elapsed if elapsed else 0.0,
+        "ttft_seconds": percentiles([r.ttft for r in ok if r.ttft is not None]),
+        "turn_latency_seconds": {
+            mode: percentiles([r.latency for r in ok if r.mode == mode]) for mode in ("stream", "sync")
+        },
+        "orchestrator_health": health
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def wait_healthy(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Orchestrator exited with code {process.returncode}")
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Orchestrator did not become healthy")
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    llm_config = FakeLLMConfig(
+        ttft=args.llm_ttft, tokens_per_second=args.llm_tokens_per_second, tokens=args.llm_tokens,
+        tool_every=args.tool_every, tool_argument_chunks=args.tool_argument_chunks,
+        slots=args.llm_slots, prefill_tokens_per_second=args.llm_prefill_rate
+    )
+    jupyter_config = FakeJupyterConfig(
+        kernel_start=args.kernel_start, exec_time=args.exec_time,
+        output_chunks=args.output_chunks, output_bytes=args.output_bytes
+    )
+    llm_app, jupyter_app = create_fake_llm(llm_config), create_fake_jupyter(jupyter_config)
+    llm_port, jupyter_port, api_port = free_port(), free_port(), free_port()
+    servers = [serve_in_thread(llm_app, llm_port), serve_in_thread(jupyter_app, jupyter_port)]
+    
+    data_dir = tempfile.mkdtemp(prefix="localgpt-bench-")
+    env = {
+        **os.environ,
+        "OPENAI_BASE": f"http://127.0.0.1:{llm_port}/v1",
+        "JUPYTER_GATEWAY_URL": f"http://127.0.0.1:{jupyter_port}",
+        "LLAMA_SLOTS": str(args.llm_slots),
+        "CONVERSATION_DB_PATH": os.path.join(data_dir, "conversations.db"),
+        "BROWSER_CACHE_DIR": os.path.join(data_dir, "http_cache"),
+        "FRONTEND_BUILD_DIR": os.path.join(data_dir, "no-frontend"),
+        **dict(item.split("=", 1) for item in args.env)
+    }
+    base_url = f"http://127.0.0.1:{api_port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+         "--port", str(api_port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    try:
+        await wait_healthy(base_url, process)
+        if args.warmup:
+            await drive(base_url, argparse.Namespace(**{**vars(args), "requests": args.warmup}))
+        
+        sampler = ProcessSampler(process.pid)
+        sampler.start()
+        results = await drive(base_url, args)
+        results["orchestrator_process"] = sampler.stop()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for server in servers:
+            server.should_exit = True
+    
+    results["fake_llm"] = {**vars(llm_app.state.stats), "slot_prompts": len(llm_app.state.stats.slot_prompts)}
+    results["fake_jupyter"] = vars(jupyter_app.state.stats)
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "results": results
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the orchestrator against fake backends")
+    parser.add_argument("--requests", type=int, default=200, help="turns to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="turns in flight")
+    parser.add_argument("--stream-ratio", type=float, default=1.0, help="share of turns using /chat/stream")
+    parser.add_argument("--conversations", type=int, default=0,
+                        help="reuse this many conversations (multi-turn), 0 starts a new one per turn")
+    parser.add_argument("--message", default="hello", help="user message text")
+    parser.add_argument("--warmup", type=int, default=0, help="turns sent before measuring")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-ttft", type=float, default=0.05)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200)
+    parser.add_argument("--llm-tokens", type=int, default=64)
+    parser.add_argument("--llm-slots", type=int, default=4)
+    parser.add_argument("--llm-prefill-rate", type=float, default=0, help="prompt tokens/s, 0 disables")
+    parser.add_argument("--tool-every", type=int, default=0, help="every Nth turn calls python, 0 never")
+    parser.add_argument("--tool-argument-chunks", type=int, default=1, help="tokens the tool arguments stream in")
+    parser.add_argument("--kernel-start", type=float, default=0.5)
+    parser.add_argument("--exec-time", type=float, default=0.05)
+    parser.add_argument("--output-chunks", type=int, default=1)
+    parser.add_argument("--output-bytes", type=int, default=32)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra orchestrator environment, repeatable")
+    parser.add_argument("--out", help="write the JSON report here as well as to stdout")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
@@ -64,6 +64,8 @@ function App() {
       const decoder = new TextDecoder();
       let accumulatedContent = '';
       let toolStatus = '';
+      let toolOutput = '';
+      let artifacts = '';
 
       while (true) {
         const { done, value } = await reader.read();
@@ -87,7 +89,7 @@ function App() {
                   setMessages(prevMessages => 
                     prevMessages.map(msg => 
                       msg.id === assistantMessageId 
-                        ? { ...msg, message: accumulatedContent + (toolStatus ? `\n\n_${toolStatus}_` : '') }
+                        ? { ...msg, message: accumulatedContent + (toolStatus ? `\n\n_${toolStatus}_` : '') + artifacts }
                         : msg
                     )
                   );
@@ -126,7 +128,36 @@ function App() {
                   );
                   break;
 
+                case 'tool_output':
+                  // Show the tail of the running tool's live output
+                  toolOutput = (toolOutput + data.content).slice(-2000);
+                  toolStatus = `🔧 Running ${data.tool_name}...`;
+                  setMessages(prevMessages => 
+                    prevMessages.map(msg => 
+                      msg.id === assistantMessageId 
+                        ? { ...msg, message: accumulatedContent + `\n\n_${toolStatus}_\n\n\`\`\`\n${toolOutput}\n\`\`\`` }
+                        : msg
+                    )
+                  );
+                  break;
+
+                case 'tool_artifact':
+                  // Plots and other rich outputs are served by reference
+                  const artifactUrl = `${API_BASE}${data.artifact.url}`;
+                  artifacts += data.artifact.mime.startsWith('image/')
+                    ? `\n\n![${data.artifact.mime}](${artifactUrl})`
+                    : `\n\n[${data.artifact.mime} output](${artifactUrl})`;
+                  setMessages(prevMessages => 
+                    prevMessages.map(msg => 
+                      msg.id === assistantMessageId 
+                        ? { ...msg, message: accumulatedContent + `\n\n_${toolStatus}_` + artifacts }
+                        : msg
+                    )
+                  );
+                  break;
+
                 case 'tool_result':
+                  toolOutput = '';
                   toolStatus = `✅ ${data.tool_name}: ${data.result}`;
                   setMessages(prevMessages => 
                     prevMessages.map(msg => 
@@ -150,10 +181,11 @@ function App() {
                   break;
 
                 case 'complete':
+                case 'cancelled':
                   setMessages(prevMessages => 
                     prevMessages.map(msg => 
                       msg.id === assistantMessageId 
-                        ? { ...msg, message: accumulatedContent, isStreaming: false }
+                        ? { ...msg, message: accumulatedContent + artifacts, isStreaming: false }
                         : msg
                     )
                   );